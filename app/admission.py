@@ -0,0 +1,271 @@
+
+import asyncio
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.metrics import REGISTRY, Counter, Gauge
+from app.storage import ProcessSQLite
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Долгие запросы на много изображений или кадров
+BATCH_PATHS = ("/api/v1/analyze/batch", "/api/v1/analyze/tiled", "/api/v1/analyze/video", "/api/v1/analyze/sequence")
+
+ADMISSION = REGISTRY.register(Counter(
+    "tree_admission_requests_total", "Admission decisions for rate-limited endpoints", ["lane", "result"]
+))
+
+
+def _refill(tokens: float, updated_at: float, now: float, rate: float, burst: float) -> float:
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+
+class MemoryBucketStore:
+    """
+    Token bucket'ы в памяти процесса. Число ключей ограничено: давно не
+    использованные клиенты вытесняются (их корзина и так уже полная).
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Списывает cost токенов; 0 - разрешено, иначе сколько секунд ждать"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = _refill(tokens, updated_at, now, rate, burst)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                self._buckets.move_to_end(key)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            return (cost - tokens) / rate
+
+
+class SQLiteBucketStore:
+    """
+    Token bucket'ы в SQLite-файле, общие для всех процессов-воркеров
+    (gunicorn): лимит клиента не умножается на число воркеров.
+    Время - wall clock, так как monotonic у разных процессов не сравнимо.
+    take блокируется на транзакции, поэтому вызывается вне event loop.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, ttl_seconds: float = 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._db = ProcessSQLite(path, self._setup, timeout=5, synchronous="NORMAL")
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @staticmethod
+    def _setup(db):
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS admission_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = time.time()
+        with self._lock:
+            db = self._db.get()
+            # Чтение и запись одной транзакцией: другой процесс не спишет те же токены
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT tokens, updated_at FROM admission_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = _refill(row[0], row[1], now, rate, burst) if row is not None else burst
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                db.execute(
+                    "INSERT OR REPLACE INTO admission_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key, tokens, now)
+                )
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    db.execute("DELETE FROM admission_buckets WHERE updated_at < ?", (now - self.ttl_seconds,))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            return 0.0 if allowed else (cost - tokens) / rate
+
+
+def create_bucket_store(kind: str, path: Optional[str] = None):
+    if kind == "sqlite":
+        if not path:
+            raise ValueError("ADMISSION_STORE=sqlite requires ADMISSION_STORE_PATH")
+        return SQLiteBucketStore(path)
+    if kind == "memory":
+        return MemoryBucketStore()
+    raise ValueError(f"Unknown admission store: {kind}")
+
+
+class Lane:
+    """Полоса приоритета: лимит частоты на клиента и доля общего лимита одновременных запросов"""
+
+    def __init__(self, name: str, rate: float, burst: float, max_concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+
+
+class AdmissionController:
+    """
+    Допуск запросов к дорогим эндпоинтам до того, как они займут пул анализа.
+
+    1. Token bucket на клиента (разрешенный API-ключ или IP) в каждой полосе - при
+       исчерпании 429 с Retry-After.
+    2. Общий лимит одновременных запросов воркера: пакетная полоса может
+       занять только свою часть слотов, остальные зарезервированы за
+       интерактивной - при нехватке слотов сразу 503 с Retry-After, без очереди.
+
+    Слоты считаются в рамках процесса: они защищают его собственный пул анализа.
+    """
+
+    def __init__(self, store, lanes: dict, max_concurrency: int, retry_after: float = 1.0):
+        self.store = store
+        self.lanes = lanes
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self._active = {name: 0 for name in lanes}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> int:
+        return sum(self._active.values())
+
+    async def check_rate(self, lane: Lane, client: str) -> float:
+        if lane.rate <= 0:
+            return 0.0
+        key = f"{lane.name}:{client}"
+        if getattr(self.store, "blocking", False):
+            return await asyncio.to_thread(self.store.take, key, lane.rate, lane.burst)
+        return self.store.take(key, lane.rate, lane.burst)
+
+    def acquire(self, lane: Lane) -> bool:
+        with self._lock:
+            if self.max_concurrency and self.active >= self.max_concurrency:
+                return False
+            if lane.max_concurrency and self._active[lane.name] >= lane.max_concurrency:
+                return False
+            self._active[lane.name] += 1
+            return True
+
+    def release(self, lane: Lane):
+        with self._lock:
+            self._active[lane.name] -= 1
+
+
+def lane_for(method: str, path: str) -> Optional[str]:
+    """Полоса для запроса или None, если эндпоинт не ограничивается"""
+    if method != "POST" and not path.startswith("/api/v1/demo"):
+        return None
+    if path in BATCH_PATHS or path.startswith("/api/v1/jobs"):
+        return BATCH
+    if path.startswith("/api/v1/analyze") or path.startswith("/api/v1/demo"):
+        return INTERACTIVE
+    return None
+
+
+class AdmissionMiddleware:
+    """
+    ASGI-middleware допуска. Слот держится до конца отправки ответа,
+    включая потоковые (NDJSON) ответы.
+    """
+
+    def __init__(self, app, controller: AdmissionController, trust_forwarded: bool = False, api_keys=()):
+        self.app = app
+        self.controller = controller
+        self.trust_forwarded = trust_forwarded
+        # Хэши разрешенных ключей: неизвестный X-API-Key не дает отдельной корзины
+        self.api_keys = {_key_hash(key.encode()) for key in api_keys}
+
+    async def __call__(self, scope, receive, send):
+        lane_name = lane_for(scope.get("method", ""), scope.get("path", "")) if scope["type"] == "http" else None
+        if lane_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        lane = self.controller.lanes[lane_name]
+        wait = await self.controller.check_rate(lane, self._client(scope))
+        if wait > 0:
+            ADMISSION.inc(lane=lane_name, result="rate_limited")
+            await _reject(send, 429, "Rate limit exceeded", wait)
+            return
+        if not self.controller.acquire(lane):
+            ADMISSION.inc(lane=lane_name, result="overloaded")
+            await _reject(send, 503, "Server is busy: too many concurrent requests", self.controller.retry_after)
+            return
+
+        ADMISSION.inc(lane=lane_name, result="admitted")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(lane)
+
+    def _client(self, scope) -> str:
+        headers = dict(scope.get("headers") or ())
+        api_key = headers.get(b"x-api-key")
+        if api_key:
+            # В хранилище (в том числе на диск) попадает хэш, а не сам ключ
+            key_hash = _key_hash(api_key)
+            if key_hash in self.api_keys:
+                return "key:" + key_hash
+        forwarded = headers.get(b"x-forwarded-for")
+        if self.trust_forwarded and forwarded:
+            return "ip:" + forwarded.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+
+def _key_hash(api_key: bytes) -> str:
+    return hashlib.blake2b(api_key, digest_size=16).hexdigest()
+
+
+async def _reject(send, status: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_admission_controller(settings) -> AdmissionController:
+    max_concurrency = settings.admission_max_concurrency
+    lanes = {
+        INTERACTIVE: Lane(INTERACTIVE, settings.admission_rate, settings.admission_burst, 0),
+        BATCH: Lane(BATCH, settings.admission_batch_rate, settings.admission_batch_burst,
+                    max(1, int(max_concurrency * settings.admission_batch_share)) if max_concurrency else 0),
+    }
+    controller = AdmissionController(
+        create_bucket_store(settings.admission_store, settings.admission_store_path),
+        lanes, max_concurrency, settings.admission_retry_after
+    )
+    REGISTRY.register(Gauge(
+        "tree_admission_active_requests", "Requests currently holding an admission slot",
+        callback=lambda: controller.active
+    ))
+    return controller
@@ -0,0 +1,161 @@
+
+import asyncio
+import time
+from collections import Counter
+from typing import Awaitable, Callable, List, Optional
+
+
+class DeadlineExceeded(Exception):
+    """Запрос не успел попасть в батч до своего дедлайна"""
+
+
+class BatcherSaturated(Exception):
+    """Очередь микробатчинга переполнена"""
+
+
+class MicroBatcher:
+    """
+    Динамический батчинг: собирает одиночные запросы в батч, пока не наберется
+    max_batch_size элементов или не пройдет max_wait_ms с момента прихода первого,
+    выполняет один вызов process_batch и раздает результаты ожидающим.
+
+    process_batch получает список элементов и возвращает список результатов
+    той же длины; элемент-исключение передается только своему запросу.
+    Собранный батч отправляется сразу, не дожидаясь завершения предыдущих:
+    медленный батч не задерживает остальные, а параллелизм ограничивает сам
+    бэкенд. max_queue - предел запросов, ожидающих результата (в очереди и в
+    выполняющихся батчах).
+    """
+
+    def __init__(self, process_batch: Callable[[list], Awaitable[list]], max_batch_size: int = 8,
+                 max_wait_ms: float = 5.0, max_queue: int = 1024):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self._queue = None
+        self._worker = None
+        self._tasks = set()
+        self._pending = 0
+        # Метрики
+        self.batches = 0
+        self.items = 0
+        self.expired = 0
+        self.batch_sizes = Counter()
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    def _ensure_started(self):
+        # Очередь и воркер создаются внутри работающего event loop
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def pending(self) -> int:
+        """Запросы, ожидающие результата: в очереди и в выполняющихся батчах"""
+        return self._pending
+
+    async def submit(self, item, timeout: Optional[float] = None):
+        """Ставит элемент в очередь и ждет его результат; timeout - дедлайн запроса в секундах"""
+        self._ensure_started()
+        if self._pending >= self.max_queue:
+            raise BatcherSaturated(f"Batching queue is full ({self.max_queue} items)")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        now = time.monotonic()
+        deadline = now + timeout if timeout is not None else None
+        self._queue.put_nowait((item, future, deadline, now))
+        self._pending += 1
+
+        try:
+            if timeout is None:
+                return await future
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Detection did not complete within {timeout}s")
+        finally:
+            self._pending -= 1
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            window_end = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = window_end - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Короткий опрос вместо wait_for(queue.get()): отмена по таймауту
+                # в wait_for может потерять уже извлеченный из очереди элемент
+                if self._queue.empty():
+                    await asyncio.sleep(min(remaining, 0.001))
+                    continue
+                batch.append(self._queue.get_nowait())
+
+            task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: List[tuple]):
+        now = time.monotonic()
+        live = []
+        for item, future, deadline, enqueued_at in batch:
+            # Отмененные и просроченные запросы в бэкенд не отправляем
+            if future.done():
+                # Клиент уже перестал ждать (истек таймаут или запрос отменен)
+                self.expired += 1
+                continue
+            if deadline is not None and deadline <= now:
+                self.expired += 1
+                future.set_exception(DeadlineExceeded("Detection deadline expired in queue"))
+                continue
+            wait = now - enqueued_at
+            self.total_queue_wait += wait
+            self.max_queue_wait = max(self.max_queue_wait, wait)
+            live.append((item, future))
+
+        if not live:
+            return
+
+        self.batches += 1
+        self.items += len(live)
+        self.batch_sizes[len(live)] += 1
+
+        try:
+            results = await self.process_batch([item for item, _ in live])
+        except Exception as e:
+            results = [e] * len(live)
+
+        for (_, future), result in zip(live, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self.queue_depth,
+            "pending": self.pending,
+            "batches": self.batches,
+            "items": self.items,
+            "expired": self.expired,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "avg_queue_wait_ms": round(self.total_queue_wait / self.items * 1000.0, 2) if self.items else 0.0,
+            "max_queue_wait_ms": round(self.max_queue_wait * 1000.0, 2),
+        }
@@ -0,0 +1,135 @@
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.storage import ProcessSQLite
+
+
+class DetectionCache:
+    """
+    Кэш результатов детекции по содержимому изображения.
+
+    Ключ - BLAKE2-хэш исходных байтов изображения + model_id + порог уверенности
+    + параметры постобработки: в кэше лежат уже отфильтрованные детекции, и
+    после смены порогов или top_k старые записи не должны попадать в выдачу.
+    Память: LRU с ограничением по количеству записей и TTL.
+    Диск (опционально): SQLite-файл, переживает перезапуск и общий для
+    процессов-воркеров; читается и пишется вне event loop. Счетчики
+    попаданий ведутся в рамках процесса.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Отдельная блокировка для SQLite: поиск в памяти не ждет дисковых операций
+        self._db_lock = threading.Lock()
+        self._db = ProcessSQLite(disk_path, self._setup) if disk_path is not None else None
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _setup(db):
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            "key TEXT PRIMARY KEY, detections TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model_id: str, confidence_threshold: float, postprocess: str = "") -> str:
+        digest = hashlib.blake2b(image_bytes, digest_size=20).hexdigest()
+        return f"{digest}:{model_id}:{confidence_threshold}:{postprocess}"
+
+    async def get(self, key: str) -> Optional[list]:
+        """
+        Поиск в памяти выполняется сразу, в SQLite - в отдельном потоке:
+        файл общий для воркеров, и ожидание блокировки записи не должно
+        останавливать event loop
+        """
+        detections = self._get_memory(key)
+        if detections is None and self.disk_path is not None:
+            detections = await asyncio.to_thread(self._get_disk, key)
+            if detections is not None:
+                self.disk_hits += 1
+        if detections is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _copy_detections(detections)
+
+    async def set(self, key: str, detections: list):
+        expires_at = time.time() + self.ttl_seconds
+        detections = _copy_detections(detections)
+        with self._lock:
+            self._remember(key, detections, expires_at)
+        if self.disk_path is not None:
+            await asyncio.to_thread(self._set_disk, key, detections, expires_at)
+
+    def _get_memory(self, key: str) -> Optional[list]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, detections = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                return detections
+            del self._entries[key]
+            return None
+
+    def _get_disk(self, key: str) -> Optional[list]:
+        with self._db_lock:
+            row = self._db.get().execute(
+                "SELECT detections, expires_at FROM detections WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        detections = json.loads(row[0])
+        with self._lock:
+            self._remember(key, detections, row[1])
+        return detections
+
+    def _set_disk(self, key: str, detections: list, expires_at: float):
+        with self._db_lock:
+            db = self._db.get()
+            db.execute(
+                "INSERT OR REPLACE INTO detections (key, detections, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(detections), expires_at)
+            )
+            # Периодически чистим просроченные записи на диске
+            self._writes += 1
+            if self._writes % 100 == 0:
+                db.execute("DELETE FROM detections WHERE expires_at <= ?", (time.time(),))
+
+    def _remember(self, key: str, detections: list, expires_at: float):
+        self._entries[key] = (expires_at, detections)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_path": self.disk_path,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+def _copy_detections(detections: list) -> list:
+    # Вызывающий код может менять детекции, поэтому в кэше храним свои копии
+    return [dict(detection, bbox=list(detection["bbox"])) for detection in detections]
@@ -0,0 +1,173 @@
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+class Settings:
+    """Настройки сервиса, читаются из переменных окружения (.env)"""
+
+    def __init__(self):
+        # Пул для блокирующих и CPU-bound этапов анализа: "thread" или "process"
+        self.executor_kind = os.getenv("EXECUTOR_KIND", "thread").lower()
+        self.executor_workers = _env_int("EXECUTOR_WORKERS", min(32, (os.cpu_count() or 1) + 4))
+        # Сколько задач может ждать свободного воркера сверх уже выполняемых;
+        # при переполнении сервер отвечает 503 вместо бесконечной очереди
+        self.executor_queue_size = _env_int("EXECUTOR_QUEUE_SIZE", 64)
+
+        # Ограничения входного изображения и рабочее разрешение детектора:
+        # большая сторона уменьшается до DETECTOR_INPUT_SIZE еще при декодировании
+        self.max_image_bytes = _env_int("MAX_IMAGE_BYTES", 25 * 1024 * 1024)
+        self.max_image_pixels = _env_int("MAX_IMAGE_PIXELS", 100_000_000)
+        self.detector_input_size = _env_int("DETECTOR_INPUT_SIZE", 1280)
+
+        # Пакетный анализ: максимум изображений в запросе и параллельных детекций
+        self.batch_max_images = _env_int("BATCH_MAX_IMAGES", 100)
+        self.batch_concurrency = _env_int("BATCH_CONCURRENCY", 8)
+
+        # Кэш детекций по содержимому изображения (0 записей - кэш выключен)
+        self.detection_cache_size = _env_int("DETECTION_CACHE_SIZE", 1024)
+        self.detection_cache_ttl = _env_int("DETECTION_CACHE_TTL", 24 * 3600)
+        # Путь к SQLite-файлу для дискового уровня кэша; пусто - только память
+        self.detection_cache_path = os.getenv("DETECTION_CACHE_PATH") or None
+
+        # Отложенная отрисовка: лимит памяти под исходные изображения и готовые
+        # картинки (байты), время жизни ссылки (сек), параметры по умолчанию
+        self.render_store_max_bytes = _env_int("RENDER_STORE_MAX_BYTES", 256 * 1024 * 1024)
+        self.render_cache_max_bytes = _env_int("RENDER_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        self.render_ttl = _env_int("RENDER_TTL", 600)
+        self.render_quality = _env_int("RENDER_QUALITY", 85)
+        self.render_max_dim = _env_int("RENDER_MAX_DIM", 0)
+
+        # Бэкенд детекции: "roboflow" (удаленный API), "onnx" (локальный CPU) или "stub"
+        self.detector_backend = os.getenv("DETECTOR_BACKEND", "roboflow").lower()
+
+        # Roboflow inference API; адрес можно направить на локальный стенд
+        self.roboflow_api_url = os.getenv("ROBOFLOW_API_URL", "https://serverless.roboflow.com")
+        # Без ключа бэкенд не загружается: используется заглушка, /health/ready - not_ready
+        self.roboflow_api_key = os.getenv("ROBOFLOW_API_KEY") or None
+        self.detector_model_id = os.getenv("DETECTOR_MODEL_ID", "sanitarka_label-pkxhc/2")
+        # Таймауты (сек), пул соединений и параллелизм запросов к детектору
+        self.detector_timeout = _env_float("DETECTOR_TIMEOUT", 10.0)
+        self.detector_connect_timeout = _env_float("DETECTOR_CONNECT_TIMEOUT", 3.0)
+        self.detector_max_connections = _env_int("DETECTOR_MAX_CONNECTIONS", 20)
+        self.detector_max_concurrency = _env_int("DETECTOR_MAX_CONCURRENCY", 16)
+        # Повторы с экспоненциальной задержкой и джиттером
+        self.detector_retries = _env_int("DETECTOR_RETRIES", 2)
+        self.detector_backoff_base = _env_float("DETECTOR_BACKOFF_BASE", 0.2)
+        # Circuit breaker: порог подряд идущих ошибок и время до пробного запроса (сек)
+        self.detector_breaker_threshold = _env_int("DETECTOR_BREAKER_THRESHOLD", 5)
+        self.detector_breaker_reset = _env_float("DETECTOR_BREAKER_RESET", 30.0)
+
+        # Дедлайн детекции для одного запроса (сек), включая ожидание в очереди батчинга
+        self.detection_deadline = _env_float("DETECTION_DEADLINE", 30.0)
+        # Постобработка детекций: минимальная уверенность, IoU для NMS по классам
+        # (1.0 - без NMS) и максимум объектов на изображение (0 - без ограничения)
+        self.detection_score_threshold = _env_float("DETECTION_SCORE_THRESHOLD", 0.1)
+        self.detection_iou_threshold = _env_float("DETECTION_IOU_THRESHOLD", 0.5)
+        self.detection_top_k = _env_int("DETECTION_TOP_K", 100)
+        # Микробатчинг одновременных запросов к детектору; включается только для
+        # бэкендов с настоящим пакетным инференсом (onnx), а не для roboflow и заглушки
+        self.microbatch_enabled = os.getenv("MICROBATCH_ENABLED", "1") == "1"
+        self.microbatch_max_size = _env_int("MICROBATCH_MAX_SIZE", 8)
+        self.microbatch_max_wait_ms = _env_float("MICROBATCH_MAX_WAIT_MS", 5.0)
+        self.microbatch_max_queue = _env_int("MICROBATCH_MAX_QUEUE", 1024)
+
+        # Локальный ONNX-детектор (DETECTOR_BACKEND=onnx, нужен пакет onnxruntime)
+        self.onnx_model_path = os.getenv("ONNX_MODEL_PATH", "models/detector.onnx")
+        # 0 - число потоков выбирает ONNX Runtime
+        self.onnx_intra_op_threads = _env_int("ONNX_INTRA_OP_THREADS", 0)
+        # Размер входа для моделей с динамическими размерностями
+        self.onnx_input_size = _env_int("ONNX_INPUT_SIZE", 640)
+        self.onnx_max_detections = _env_int("ONNX_MAX_DETECTIONS", 300)
+        self.onnx_class_names = os.getenv("ONNX_CLASS_NAMES", "tree,shrub").split(",")
+
+        # Потайловая детекция больших снимков (ортофото, панорамы): размер тайла и
+        # перекрытие (пиксели), тайлов в одном вызове бэкенда и одновременных вызовов
+        self.tile_size = _env_int("TILE_SIZE", 1280)
+        self.tile_overlap = _env_int("TILE_OVERLAP", 256)
+        self.tile_batch_size = _env_int("TILE_BATCH_SIZE", 8)
+        self.tile_concurrency = _env_int("TILE_CONCURRENCY", 2)
+        # Лимиты загрузки: файл сохраняется во временный каталог; несжатые растры
+        # и .npy читаются через memmap, поэтому их лимит по пикселям выше
+        self.tile_max_upload_bytes = _env_int("TILE_MAX_UPLOAD_BYTES", 4 * 1024 * 1024 * 1024)
+        self.tile_max_pixels = _env_int("TILE_MAX_PIXELS", 1_000_000_000)
+        self.tile_temp_dir = os.getenv("TILE_TEMP_DIR") or None
+        self.tile_preview_size = _env_int("TILE_PREVIEW_SIZE", 2048)
+
+        # Видео и последовательности кадров: ffmpeg, частота отбора кадров (в секунду)
+        # и порог изменения сцены для sampling=scene, лимиты загрузки и числа кадров,
+        # одновременных детекций (и кадров в буфере), максимальная сторона снимка
+        # объекта для анализа трека
+        self.ffmpeg_path = os.getenv("FFMPEG_PATH", "ffmpeg")
+        self.video_sample_fps = _env_float("VIDEO_SAMPLE_FPS", 2.0)
+        self.video_scene_threshold = _env_float("VIDEO_SCENE_THRESHOLD", 0.05)
+        self.video_max_upload_bytes = _env_int("VIDEO_MAX_UPLOAD_BYTES", 2 * 1024 * 1024 * 1024)
+        self.video_max_frames = _env_int("VIDEO_MAX_FRAMES", 3600)
+        self.video_concurrency = _env_int("VIDEO_CONCURRENCY", 4)
+        self.video_snapshot_size = _env_int("VIDEO_SNAPSHOT_SIZE", 256)
+        # IoU-трекер: порог IoU между соседними отобранными кадрами, сколько кадров
+        # объект может пропасть до закрытия трека и сколько детекций подтверждают трек
+        self.track_iou_threshold = _env_float("TRACK_IOU_THRESHOLD", 0.3)
+        self.track_max_age = _env_int("TRACK_MAX_AGE", 2)
+        self.track_min_hits = _env_int("TRACK_MIN_HITS", 2)
+
+        # Прогрев при старте воркера полной детекцией тестового изображения
+        # (для roboflow это реальный запрос к API)
+        self.detector_warmup_request = os.getenv("DETECTOR_WARMUP_REQUEST", "0") == "1"
+
+        # Детерминированный режим: выходы заглушек и эвристик выводятся из
+        # BLAKE2-хэша содержимого изображения/ROI и ANALYSIS_SEED, поэтому
+        # совпадают между вызовами, воркерами и перезапусками
+        self.deterministic = os.getenv("DETERMINISTIC", "0") == "1"
+        self.analysis_seed = _env_int("ANALYSIS_SEED", 0)
+
+        # Фоновые задачи: хранилище "memory" или "sqlite" (JOB_STORE_PATH - файл базы),
+        # число воркеров, лимит изображений в задаче и в очереди, время хранения (сек),
+        # интервал heartbeat владельца (сек): задачи процесса, молчащего дольше трех
+        # интервалов, помечаются interrupted
+        self.job_store = os.getenv("JOB_STORE", "memory").lower()
+        self.job_store_path = os.getenv("JOB_STORE_PATH") or None
+        self.job_workers = _env_int("JOB_WORKERS", 4)
+        self.job_max_images = _env_int("JOB_MAX_IMAGES", 1000)
+        self.job_max_pending = _env_int("JOB_MAX_PENDING", 10000)
+        self.job_ttl = _env_int("JOB_TTL", 24 * 3600)
+        self.job_heartbeat_interval = _env_float("JOB_HEARTBEAT_INTERVAL", 10.0)
+
+        # Допуск к /analyze*, /demo и /jobs: общий лимит одновременных запросов воркера
+        # (0 - без лимита) и доля этого лимита, доступная пакетной полосе; лимит частоты
+        # на клиента (запросов/сек и размер всплеска в интерактивной и пакетной полосах).
+        # Частота по умолчанию не ограничивается (0): за балансировщиком без
+        # ADMISSION_TRUST_FORWARDED у всех клиентов один IP. Клиент - ключ из
+        # ADMISSION_API_KEYS (через запятую), переданный в X-API-Key, иначе IP.
+        # Хранилище лимитов "memory" или "sqlite" (ADMISSION_STORE_PATH) - общее для воркеров gunicorn
+        self.admission_enabled = os.getenv("ADMISSION_ENABLED", "1") == "1"
+        self.admission_rate = _env_float("ADMISSION_RATE", 0.0)
+        self.admission_burst = _env_float("ADMISSION_BURST", 20.0)
+        self.admission_batch_rate = _env_float("ADMISSION_BATCH_RATE", 0.0)
+        self.admission_batch_burst = _env_float("ADMISSION_BATCH_BURST", 5.0)
+        self.admission_max_concurrency = _env_int("ADMISSION_MAX_CONCURRENCY", 2 * self.executor_workers)
+        self.admission_batch_share = _env_float("ADMISSION_BATCH_SHARE", 0.5)
+        self.admission_retry_after = _env_float("ADMISSION_RETRY_AFTER", 1.0)
+        self.admission_store = os.getenv("ADMISSION_STORE", "memory").lower()
+        self.admission_store_path = os.getenv("ADMISSION_STORE_PATH") or None
+        self.admission_api_keys = [key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(",") if key.strip()]
+        # Брать IP клиента из X-Forwarded-For (только за доверенным прокси)
+        self.admission_trust_forwarded = os.getenv("ADMISSION_TRUST_FORWARDED", "0") == "1"
+
+        # Заголовок Server-Timing с временами этапов в ответах /analyze
+        self.server_timing = os.getenv("SERVER_TIMING", "0") == "1"
+
+
+settings = Settings()
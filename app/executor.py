@@ -0,0 +1,86 @@
+
+import asyncio
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Optional
+
+
+class ExecutorSaturated(Exception):
+    """Пул воркеров и очередь ожидания заполнены"""
+
+
+class AnalysisExecutor:
+    """
+    Пул для блокирующих и CPU-bound этапов анализа (сетевой вызов детектора,
+    декодирование, кроп, отрисовка, JPEG-кодирование).
+
+    Глубина очереди ограничена: одновременно принимается не больше
+    max_workers + queue_size задач, остальные сразу получают ExecutorSaturated.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 4, queue_size: int = 64,
+                 initializer: Optional[Callable] = None):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unsupported executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.initializer = initializer
+        self._pool: Optional[Executor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.queue_size
+
+    @property
+    def pending(self) -> int:
+        """Количество задач в работе и в очереди"""
+        return self._pending
+
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.kind == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analysis")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func: Callable, *args):
+        """Выполняет func(*args) в пуле; при переполнении бросает ExecutorSaturated"""
+        if self._pool is None:
+            self.start()
+
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise ExecutorSaturated(f"Analysis queue is full ({self.capacity} tasks)")
+            self._pending += 1
+
+        try:
+            future = self._pool.submit(func, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        # Слот освобождается, когда задача реально завершилась в воркере,
+        # а не когда клиент перестал ждать ответа
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def status(self) -> dict:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "queue_size": self.queue_size,
+            "pending": self._pending,
+        }
@@ -0,0 +1,463 @@
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+from app.storage import ProcessSQLite
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+# Процесс, обрабатывавший задачу, завершился, не закончив ее
+INTERRUPTED = "interrupted"
+FINISHED_STATUSES = (COMPLETED, CANCELLED, INTERRUPTED)
+UNFINISHED_STATUSES = (QUEUED, RUNNING)
+
+
+class JobQueueFull(Exception):
+    """Очередь изображений фоновых задач заполнена"""
+
+
+def _job_view(job: dict) -> dict:
+    done = job["completed"] + job["failed"]
+    return dict(job, progress=round(done / job["total"], 4) if job["total"] else 1.0)
+
+
+class JobStore:
+    """
+    Хранилище состояния фоновых задач и их результатов.
+
+    Результаты изображений нумеруются seq (1, 2, ...) в порядке завершения,
+    что позволяет клиенту дочитывать их порциями: results(job_id, after=seq).
+    Запись результата хранится как dict: index, success, error, results, objects_detected.
+
+    Изображения задачи ждут обработки в памяти процесса-владельца (owner),
+    который периодически подтверждает владение через heartbeat.
+    """
+
+    # Вызовы блокируют поток (файл, транзакции) - JobManager выносит их из event loop
+    blocking = False
+
+    def create(self, job_id: str, total: int, owner: Optional[str] = None) -> dict:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set_status(self, job_id: str, status: str, only_from: tuple = ()) -> Optional[dict]:
+        """Меняет статус; only_from - допустимые текущие статусы (пусто - любой)"""
+        raise NotImplementedError
+
+    def add_result(self, job_id: str, record: dict) -> Optional[dict]:
+        """Сохраняет результат изображения; последний результат завершает задачу"""
+        raise NotImplementedError
+
+    def results(self, job_id: str, after: int = 0, limit: int = 0) -> List[dict]:
+        raise NotImplementedError
+
+    def cleanup(self, finished_before: float) -> int:
+        """Удаляет завершенные задачи, не менявшиеся с finished_before"""
+        raise NotImplementedError
+
+    def heartbeat(self, owner: str):
+        """Подтверждает, что owner жив и продолжает обрабатывать свои задачи"""
+        raise NotImplementedError
+
+    def interrupt_stale(self, stale_before: float) -> int:
+        """Помечает interrupted незавершенные задачи, чей владелец молчит с stale_before"""
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+    """
+    Хранилище в памяти процесса; задачи теряются при перезапуске вместе
+    с очередью, поэтому задач без владельца в нем не бывает
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, total, owner=None):
+        now = time.time()
+        job = {"job_id": job_id, "status": QUEUED, "total": total, "completed": 0, "failed": 0,
+               "created_at": now, "updated_at": now}
+        with self._lock:
+            self._jobs[job_id] = job
+            self._results[job_id] = []
+        return _job_view(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return _job_view(job) if job is not None else None
+
+    def set_status(self, job_id, status, only_from=()):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if not only_from or job["status"] in only_from:
+                job["status"] = status
+                job["updated_at"] = time.time()
+            return _job_view(job)
+
+    def add_result(self, job_id, record):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            results = self._results[job_id]
+            results.append(dict(record, seq=len(results) + 1))
+            job["completed" if record.get("success") else "failed"] += 1
+            if job["completed"] + job["failed"] >= job["total"] and job["status"] not in FINISHED_STATUSES:
+                job["status"] = COMPLETED
+            job["updated_at"] = time.time()
+            return _job_view(job)
+
+    def results(self, job_id, after=0, limit=0):
+        with self._lock:
+            # seq совпадает с позицией в списке + 1
+            records = self._results.get(job_id, [])[after:]
+            return list(records[:limit] if limit else records)
+
+    def cleanup(self, finished_before):
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["status"] in FINISHED_STATUSES and job["updated_at"] < finished_before
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+                del self._results[job_id]
+        return len(expired)
+
+    def heartbeat(self, owner):
+        pass
+
+    def interrupt_stale(self, stale_before):
+        return 0
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Хранилище в SQLite-файле: задачи и результаты переживают перезапуск,
+    а опрос и стриминг работают из любого процесса-воркера сервера.
+    Незавершенные задачи упавшего или перезапущенного процесса (его heartbeat
+    устарел) помечаются interrupted - их изображения были только в его памяти.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = ProcessSQLite(path, self._setup, timeout=30, row_factory=sqlite3.Row)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _setup(db):
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, "
+            "completed INTEGER NOT NULL, failed INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "owner TEXT, heartbeat_at REAL)"
+        )
+        # Базы, созданные до появления владельцев задач
+        columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                try:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    # Колонку уже добавил другой процесс
+                    pass
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS job_results ("
+            "job_id TEXT NOT NULL, seq INTEGER NOT NULL, record TEXT NOT NULL, "
+            "PRIMARY KEY (job_id, seq))"
+        )
+
+    def _get(self, db, job_id):
+        row = db.execute(
+            "SELECT job_id, status, total, completed, failed, created_at, updated_at FROM jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        return _job_view(dict(row)) if row is not None else None
+
+    def create(self, job_id, total, owner=None):
+        now = time.time()
+        with self._lock:
+            db = self._db.get()
+            db.execute(
+                "INSERT INTO jobs (job_id, status, total, completed, failed, created_at, updated_at, owner, heartbeat_at) "
+                "VALUES (?, ?, ?, 0, 0, ?, ?, ?, ?)",
+                (job_id, QUEUED, total, now, now, owner, now)
+            )
+            return self._get(db, job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._get(self._db.get(), job_id)
+
+    def set_status(self, job_id, status, only_from=()):
+        with self._lock:
+            db = self._db.get()
+            query = "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?"
+            params = [status, time.time(), job_id]
+            if only_from:
+                query += f" AND status IN ({','.join('?' * len(only_from))})"
+                params.extend(only_from)
+            db.execute(query, params)
+            return self._get(db, job_id)
+
+    def add_result(self, job_id, record):
+        column = "completed" if record.get("success") else "failed"
+        with self._lock:
+            db = self._db.get()
+            # BEGIN IMMEDIATE сериализует запись между процессами: seq не повторяется
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._get(db, job_id)
+                if job is None:
+                    db.execute("ROLLBACK")
+                    return None
+                seq = job["completed"] + job["failed"] + 1
+                db.execute(
+                    "INSERT INTO job_results (job_id, seq, record) VALUES (?, ?, ?)",
+                    (job_id, seq, json.dumps(dict(record, seq=seq)))
+                )
+                status = job["status"]
+                if seq >= job["total"] and status not in FINISHED_STATUSES:
+                    status = COMPLETED
+                db.execute(
+                    f"UPDATE jobs SET {column} = {column} + 1, status = ?, updated_at = ? WHERE job_id = ?",
+                    (status, time.time(), job_id)
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            return self._get(db, job_id)
+
+    def results(self, job_id, after=0, limit=0):
+        with self._lock:
+            rows = self._db.get().execute(
+                "SELECT record FROM job_results WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after, limit or -1)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def cleanup(self, finished_before):
+        placeholders = ",".join("?" * len(FINISHED_STATUSES))
+        with self._lock:
+            db = self._db.get()
+            expired = [
+                row[0] for row in db.execute(
+                    f"SELECT job_id FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+                    (*FINISHED_STATUSES, finished_before)
+                )
+            ]
+            for job_id in expired:
+                db.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+                db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return len(expired)
+
+    def heartbeat(self, owner):
+        placeholders = ",".join("?" * len(UNFINISHED_STATUSES))
+        with self._lock:
+            self._db.get().execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ({placeholders})",
+                (time.time(), owner, *UNFINISHED_STATUSES)
+            )
+
+    def interrupt_stale(self, stale_before):
+        placeholders = ",".join("?" * len(UNFINISHED_STATUSES))
+        with self._lock:
+            cursor = self._db.get().execute(
+                f"UPDATE jobs SET status = ?, updated_at = ? WHERE status IN ({placeholders}) "
+                "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (INTERRUPTED, time.time(), *UNFINISHED_STATUSES, stale_before)
+            )
+            return cursor.rowcount
+
+
+def create_job_store(kind: str, path: Optional[str] = None) -> JobStore:
+    if kind == "memory":
+        return InMemoryJobStore()
+    if kind == "sqlite":
+        if not path:
+            raise ValueError("JOB_STORE=sqlite requires JOB_STORE_PATH")
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job store: {kind}")
+
+
+class JobManager:
+    """
+    Фоновая обработка задач: изображения ставятся в общую очередь,
+    num_workers корутин обрабатывают их через process_image и пишут
+    результаты в хранилище.
+
+    process_image(image_data) возвращает запись результата (success, error,
+    results, objects_detected). Исключения из retry_on (переполнение пулов)
+    не считаются ошибкой изображения: обработка повторяется с задержкой.
+
+    Каждые heartbeat_interval секунд менеджер подтверждает владение своими
+    задачами и помечает interrupted чужие, владелец которых молчит дольше
+    трех интервалов (процесс упал или перезапущен). Вызовы блокирующего
+    хранилища идут через asyncio.to_thread.
+    """
+
+    def __init__(self, store: JobStore, process_image: Callable[[object], Awaitable[dict]],
+                 num_workers: int = 4, max_pending: int = 10000, ttl_seconds: float = 3600,
+                 retry_on: tuple = (), retry_delay: float = 0.5, heartbeat_interval: float = 10.0):
+        self.store = store
+        self.process_image = process_image
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.retry_on = retry_on
+        self.retry_delay = retry_delay
+        self.heartbeat_interval = heartbeat_interval
+        self.owner = None
+        self._queue = None
+        self._workers = []
+        self._events = {}
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Изображения, ожидающие обработки (включая изображения отмененных задач)"""
+        return self._pending
+
+    def start(self):
+        if self._workers:
+            return
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.num_workers)]
+        self._workers.append(loop.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _call(self, method, *args, **kwargs):
+        """Вызов хранилища; блокирующее хранилище - в отдельном потоке"""
+        if self.store.blocking:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self._call(self.store.get, job_id)
+
+    async def results(self, job_id: str, after: int = 0, limit: int = 0) -> List[dict]:
+        return await self._call(self.store.results, job_id, after=after, limit=limit)
+
+    async def submit(self, images: list) -> dict:
+        if self._queue is None:
+            raise RuntimeError("Job manager is not started")
+        if self._pending + len(images) > self.max_pending:
+            raise JobQueueFull(f"Job queue is full ({self._pending} images pending, limit {self.max_pending})")
+
+        # Резервируем место до await, чтобы параллельные submit не превысили лимит
+        self._pending += len(images)
+        try:
+            await self._call(self.store.cleanup, time.time() - self.ttl_seconds)
+            job_id = uuid.uuid4().hex
+            job = await self._call(self.store.create, job_id, len(images), owner=self.owner)
+        except BaseException:
+            self._pending -= len(images)
+            raise
+        for index, image_data in enumerate(images):
+            self._queue.put_nowait((job_id, index, image_data))
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """Оставшиеся изображения задачи пропускаются; готовые результаты сохраняются"""
+        job = await self._call(self.store.set_status, job_id, CANCELLED, only_from=UNFINISHED_STATUSES)
+        self._notify(job_id)
+        return job
+
+    async def wait_for_update(self, job_id: str, timeout: float):
+        """
+        Ждет нового результата задачи из этого процесса или timeout секунд
+        (задачи других процессов видны только через опрос хранилища)
+        """
+        event = self._events.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _notify(self, job_id: str):
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self._call(self.store.heartbeat, self.owner)
+                interrupted = await self._call(
+                    self.store.interrupt_stale, time.time() - 3 * self.heartbeat_interval
+                )
+                if interrupted:
+                    print(f"Marked {interrupted} orphaned jobs as {INTERRUPTED}")
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _worker(self):
+        while True:
+            job_id, index, image_data = await self._queue.get()
+            try:
+                job = await self.get(job_id)
+                if job is None or job["status"] in FINISHED_STATUSES:
+                    continue
+                if job["status"] == QUEUED:
+                    await self._call(self.store.set_status, job_id, RUNNING, only_from=(QUEUED,))
+
+                record = await self._process(job_id, image_data)
+                if record is None:
+                    continue
+                await self._call(self.store.add_result, job_id, dict(record, index=index))
+                self._notify(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job {job_id} image {index} failed: {e}")
+            finally:
+                self._pending -= 1
+
+    async def _process(self, job_id: str, image_data) -> Optional[dict]:
+        while True:
+            try:
+                return await self.process_image(image_data)
+            except self.retry_on:
+                # Сервер перегружен синхронными запросами - фоновая задача подождет
+                await asyncio.sleep(self.retry_delay)
+                job = await self.get(job_id)
+                if job is None or job["status"] in FINISHED_STATUSES:
+                    return None
+            except Exception as e:
+                return {"success": False, "error": f"Error processing image: {str(e)}"}
+
+    def status(self) -> dict:
+        return {
+            "workers": self.num_workers,
+            "pending_images": self._pending,
+            "max_pending": self.max_pending,
+            "store": type(self.store).__name__,
+        }
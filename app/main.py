@@ -1,14 +1,54 @@
+import os
+import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import analysis, health
+from fastapi.responses import PlainTextResponse
+from app.routers import analysis, health, jobs
+from app.admission import AdmissionMiddleware, create_admission_controller
+from app.config import settings
+from app.metrics import REGISTRY
+from app.pipeline import detector
+
+# Веса и бэкенд детектора готовятся при импорте: под gunicorn с preload_app
+# это происходит один раз в мастер-процессе до fork воркеров
+detector.preload()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Запуск воркера: модели, пулы и прогрев. Воркер отвечает готовностью
+    (/api/v1/health/ready) только после завершения прогрева.
+    """
+    start_time = time.time()
+    await analysis.startup()
+    await jobs.startup()
+    health.service_state.update(ready=True, startup_time=round(time.time() - start_time, 3))
+    print(f"Worker {os.getpid()} is ready ({health.service_state['startup_time']}s)")
+    yield
+    # Снимаем готовность, чтобы балансировщик перестал слать запросы
+    health.service_state["ready"] = False
+    await jobs.shutdown()
+    await analysis.shutdown()
 
 app = FastAPI(
     title="Tree Analysis API",
     description="API для анализа состояния зеленых насаждений",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Допуск к дорогим эндпоинтам: 429/503 с Retry-After вместо очереди без границ.
+# Стоит внутри CORS, чтобы отказы тоже получали CORS-заголовки
+if settings.admission_enabled:
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=create_admission_controller(settings),
+        trust_forwarded=settings.admission_trust_forwarded,
+        api_keys=settings.admission_api_keys,
+    )
+
 # Настройка CORS
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +61,7 @@ app.add_middleware(
 # Подключение роутеров
 app.include_router(health.router, prefix="/api/v1", tags=["health"])
 app.include_router(analysis.router, prefix="/api/v1", tags=["analysis"])
+app.include_router(jobs.router, prefix="/api/v1", tags=["jobs"])
 
 @app.get("/")
 async def root():
@@ -28,9 +69,19 @@ async def root():
         "message": "Tree Analysis API Server", 
         "status": "running",
         "docs": "/docs",
-        "health": "/api/v1/health"
+        "health": "/api/v1/health",
+        "liveness": "/api/v1/health/live",
+        "readiness": "/api/v1/health/ready"
     }
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "message": "Server is running"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Метрики в текстовом формате Prometheus. Под gunicorn значения относятся
+    к воркеру, принявшему запрос: собирайте их с каждого воркера отдельно
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -1,19 +1,42 @@
 
-import random
+import numpy as np
 from PIL import Image
 
+from app.models.roi_batch import image_to_batch
+
 class TreeClassifier:
-    def __init__(self):
+    # Сторона квадратного входа классификатора (ROI масштабируются до нее)
+    input_size = 64
+    # Сетка пулинга признаков заглушки: 4x4 ячейки x 3 канала
+    grid_size = 4
+
+    def __init__(self, seed: int = 0):
         self.species_classes = [
             "дуб", "береза", "сосна", "ель", "клен", 
             "липа", "тополь", "ива", "ясень", "рябина"
         ]
+        # Фиксированная проекция признаков в "логиты" пород для заглушки;
+        # ответ зависит только от пикселей ROI и seed
+        features = self.grid_size * self.grid_size * 3
+        self.weights = np.random.default_rng(seed).standard_normal((features, len(self.species_classes))).astype(np.float32)
     
     def load_model(self, model_path: str):
         print(f"Loading classification model from {model_path} (stub implementation)")
     
     def predict_species(self, image: Image.Image) -> str:
-        # Заглушка для демонстрации
-        # В реальной реализации здесь будет модель классификации
-        image_hash = hash(image.tobytes()) if image else 0
-        return self.species_classes[image_hash % len(self.species_classes)]
+        return self.predict_species_batch(image_to_batch(image, self.input_size))[0]
+    
+    def predict_species_batch(self, batch: np.ndarray) -> list:
+        """
+        Породы для батча ROI (N, input_size, input_size, 3) float32 в [0, 1] за один проход.
+        Реальная модель получит здесь весь батч одним вызовом.
+        """
+        if len(batch) == 0:
+            return []
+        # Заглушка для демонстрации: средний цвет по ячейкам сетки -> линейная проекция
+        count = len(batch)
+        cell = self.input_size // self.grid_size
+        features = batch.reshape(count, self.grid_size, cell, self.grid_size, cell, 3).mean(axis=(2, 4))
+        features = features.reshape(count, -1)
+        logits = (features - features.mean(axis=1, keepdims=True)) @ self.weights
+        return [self.species_classes[index] for index in logits.argmax(axis=1).tolist()]
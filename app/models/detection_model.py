@@ -1,103 +1,193 @@
-import random
-import os
-from PIL import Image
-import numpy as np
-from inference_sdk import InferenceHTTPClient, InferenceConfiguration
+import asyncio
+import time
+from app.config import settings
+from app.batching import MicroBatcher, DeadlineExceeded
+from app.models.detector_backends import create_backend, StubBackend
+from app.models.postprocessing import postprocess_predictions
+from app.metrics import STAGE_SECONDS, STUB_DETECTIONS, DETECTION_CACHE
 
 class TreeDetector:
-    def __init__(self):
+    def __init__(self, cache=None):
         self.classes = ["tree", "shrub"]
-        self.client = None
+        self.backend = None
         self.is_loaded = False
-        self.model_id = "sanitarka_label-pkxhc/2"
+        self.model_id = settings.detector_model_id
+        # Необязательный DetectionCache: повторные изображения не отправляются в бэкенд
+        self.cache = cache
+        self.load_time = None
+        self.warmup_time = None
+        # Микробатчинг: одновременные запросы объединяются в один вызов бэкенда;
+        # создается в load_model, если бэкенд умеет пакетный инференс
+        self.batcher = None
+    
+    def preload(self):
+        """
+        Создает бэкенд и читает веса модели без event loop и сетевых соединений.
+        При запуске под gunicorn с preload_app выполняется в мастер-процессе
+        до fork, и воркеры получают уже прочитанные веса. Ошибки не фатальны:
+        load_model повторит попытку и при неудаче перейдет на заглушку.
+        """
+        try:
+            self.backend = create_backend(settings.detector_backend, settings)
+            self.backend.preload()
+        except Exception as e:
+            print(f"Detector preload failed: {e}")
+            self.backend = None
     
     def load_model(self):
-        """Инициализирует клиент для работы с Roboflow API"""
+        """
+        Создает бэкенд детекции, выбранный в DETECTOR_BACKEND (roboflow, onnx, stub).
+        Вызывается из lifespan приложения, т.е. внутри работающего event loop.
+        Если бэкенд не удалось инициализировать, используется заглушка.
+        """
+        start_time = time.time()
         try:
-            print("Initializing Roboflow Inference Client")
+            print(f"Initializing detector backend: {settings.detector_backend}")
             
-            # Инициализация клиента
-            self.client = InferenceHTTPClient(
-                api_url="https://serverless.roboflow.com",
-                api_key="2QOljeyuzD3EFB5yG5de"
-            )
+            if self.backend is None:
+                self.backend = create_backend(settings.detector_backend, settings)
+            self.backend.load()
             
-            self.is_loaded = True
-            print("Roboflow client initialized successfully!")
-            return True
+            self.is_loaded = not isinstance(self.backend, StubBackend)
+            print(f"Detector backend '{self.backend.name}' initialized successfully!")
             
         except Exception as e:
-            print(f"Error initializing Roboflow client: {e}")
+            print(f"Error initializing detector backend: {e}")
+            self.backend = StubBackend(self.classes, seed=settings.analysis_seed if settings.deterministic else None)
             self.is_loaded = False
-            return False
+        
+        self.model_id = self.backend.model_id
+        if settings.microbatch_enabled and self.backend.supports_batching and self.batcher is None:
+            self.batcher = MicroBatcher(
+                self._process_batch,
+                max_batch_size=settings.microbatch_max_size,
+                max_wait_ms=settings.microbatch_max_wait_ms,
+                max_queue=settings.microbatch_max_queue,
+            )
+        self.load_time = round(time.time() - start_time, 3)
+        return self.is_loaded
     
-    def detect(self, image: np.ndarray, confidence_threshold: float = 0.1) -> list:
-        """Основной метод детекции с настраиваемым порогом уверенности"""
-        # Если клиент не инициализирован, используем заглушку
-        if not self.is_loaded:
-            print("Using stub detection - model not loaded")
-            return self._stub_detection(image)
+    async def warmup(self, sample: tuple = None):
+        """
+        Прогрев бэкенда пробным инференсом, время сохраняется для /model-status.
+        sample - (байты, (ширина, высота)): если задан, дополнительно выполняется
+        полная детекция (соединения, постобработка). Ошибки прогрева не фатальны.
+        """
+        start_time = time.time()
+        try:
+            await self.backend.warmup()
+            if sample is not None:
+                results = await self.detect_batch([sample], settings.detection_score_threshold)
+                if isinstance(results[0], BaseException):
+                    raise results[0]
+        except Exception as e:
+            print(f"Detector warm-up failed: {e}")
+        self.warmup_time = round(time.time() - start_time, 3)
+    
+    async def close(self):
+        if self.batcher is not None:
+            await self.batcher.close()
+        if self.backend is not None:
+            await self.backend.close()
+    
+    async def detect(self, image_bytes: bytes, image_size: tuple, confidence_threshold: float = 0.1,
+                     timeout: float = None) -> list:
+        """
+        Основной метод детекции с настраиваемым порогом уверенности.
+        image_bytes - исходные закодированные байты изображения;
+        image_size - (ширина, высота) изображения;
+        timeout - дедлайн запроса в секундах (DeadlineExceeded при превышении).
+        
+        Ошибки удаленного бэкенда не подменяются заглушкой: бросается DetectorUnavailable.
+        """
+        if self.batcher is not None:
+            return await self.batcher.submit((image_bytes, image_size, confidence_threshold), timeout=timeout)
         
         try:
-            # Сохраняем временное изображение
-            temp_path = "temp_detection_image.jpg"
-            
-            if isinstance(image, np.ndarray):
-                # Конвертируем numpy array в PIL Image
-                if len(image.shape) == 3:
-                    # Если цветное изображение (H, W, C)
-                    if image.shape[2] == 3:
-                        # Предполагаем RGB формат
-                        pil_image = Image.fromarray(image.astype('uint8'), 'RGB')
-                    else:
-                        pil_image = Image.fromarray(image.astype('uint8'))
-                else:
-                    # Если grayscale (H, W)
-                    pil_image = Image.fromarray(image.astype('uint8'))
-                
-                pil_image.save(temp_path)
-            elif isinstance(image, Image.Image):
-                # Если это уже PIL Image
-                image.save(temp_path)
-            else:
-                raise ValueError(f"Unsupported image type: {type(image)}")
-            
-            # Создаем конфигурацию с низким порогом уверенности :cite[4]
-            low_confidence_config = InferenceConfiguration(
-                confidence_threshold=confidence_threshold  # Низкий порог = больше обнаружений
+            results = await asyncio.wait_for(
+                self.detect_batch([(image_bytes, image_size)], confidence_threshold), timeout
             )
-            
-            # Выполняем инференс с указанной конфигурацией :cite[4]
-            with self.client.use_configuration(low_confidence_config):
-                result = self.client.infer(temp_path, model_id=self.model_id)
-            
-            # Обрабатываем результат
-            if isinstance(image, Image.Image):
-                image_shape = (image.height, image.width, len(image.getbands()))
-            else:
-                image_shape = image.shape
-            
-            detections = self._process_predictions(result, image_shape)
-            
-            # Очищаем временный файл
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            
-            print(f"Detection completed: found {len(detections)} objects with confidence threshold {confidence_threshold}")
-            return detections
-            
-        except Exception as e:
-            print(f"Error during detection: {e}")
-            # Fallback to stub implementation
-            return self._stub_detection(image)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Detection did not complete within {timeout}s")
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        return results[0]
+    
+    async def _process_batch(self, items: list) -> list:
+        """Обработчик микробатча: items - тройки (байты, размер, порог уверенности)"""
+        results = [None] * len(items)
+        by_threshold = {}
+        for i, (_, _, confidence_threshold) in enumerate(items):
+            by_threshold.setdefault(confidence_threshold, []).append(i)
+        
+        for confidence_threshold, indices in by_threshold.items():
+            batch = [(items[i][0], items[i][1]) for i in indices]
+            for i, detections in zip(indices, await self.detect_batch(batch, confidence_threshold)):
+                results[i] = detections
+        return results
+    
+    async def detect_batch(self, items: list, confidence_threshold: float = 0.1) -> list:
+        """
+        Детекция для нескольких изображений одним вызовом бэкенда.
+        items - список пар (байты изображения, (ширина, высота)); результаты в том же порядке.
+        Для изображения, которое не удалось обработать, на его месте возвращается исключение.
+        """
+        if not self.is_loaded:
+            print("Using stub detection - model not loaded")
+            STUB_DETECTIONS.inc(len(items))
+        
+        use_cache = self.cache is not None and self.backend.cacheable
+        results = [None] * len(items)
+        keys = [None] * len(items)
+        
+        if use_cache:
+            for i, (image_bytes, _) in enumerate(items):
+                keys[i] = self.cache.make_key(image_bytes, self.model_id, confidence_threshold,
+                                              self._postprocess_key())
+                results[i] = await self.cache.get(keys[i])
+                DETECTION_CACHE.inc(result="miss" if results[i] is None else "hit")
+        
+        missing = [i for i, detections in enumerate(results) if detections is None]
+        if missing:
+            try:
+                with STAGE_SECONDS.time(stage="detection"):
+                    raw_results = await self.backend.infer_batch([items[i] for i in missing], confidence_threshold)
+            except Exception as e:
+                raw_results = [e] * len(missing)
+            
+            for i, result in zip(missing, raw_results):
+                if isinstance(result, BaseException):
+                    results[i] = result
+                    continue
+                width, height = items[i][1]
+                with STAGE_SECONDS.time(stage="postprocess"):
+                    results[i] = self._process_predictions(result, (height, width))
+                if use_cache:
+                    await self.cache.set(keys[i], results[i])
+            
+            print(f"Detection completed for {len(missing)} images with confidence threshold {confidence_threshold}")
+        return results
+    
+    def status(self) -> dict:
+        return {
+            "backend": self.backend.name if self.backend is not None else None,
+            "load_time": self.load_time,
+            "warmup_time": self.warmup_time,
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+            **(self.backend.status() if self.backend is not None else {}),
+        }
+    
+    @staticmethod
+    def _postprocess_key() -> str:
+        """Параметры постобработки для ключа кэша"""
+        return (f"score={settings.detection_score_threshold},iou={settings.detection_iou_threshold},"
+                f"top_k={settings.detection_top_k}")
     
     def _process_predictions(self, result: dict, image_shape) -> list:
         """Обрабатывает результат от Roboflow API"""
-        detections = []
-        
         if 'predictions' not in result:
             print("No predictions found in result")
-            return detections
+            return []
         
         # Получаем размеры изображения
         if len(image_shape) == 3:  # (height, width, channels)
@@ -105,65 +195,13 @@ class TreeDetector:
         else:  # (height, width)
             image_height, image_width = image_shape
         
-        for prediction in result['predictions']:
-            # Получаем класс и уверенность
-            class_name = prediction.get('class', 'unknown')
-            confidence = prediction.get('confidence', 0)
-            
-            # Преобразуем bounding box из формата [x, y, width, height] в [x1, y1, x2, y2]
-            x = prediction.get('x', 0)
-            y = prediction.get('y', 0)
-            width = prediction.get('width', 0)
-            height = prediction.get('height', 0)
-            
-            # Конвертируем из относительных координат в абсолютные
-            x_abs = x * image_width / 100.0
-            y_abs = y * image_height / 100.0
-            width_abs = width * image_width / 100.0
-            height_abs = height * image_height / 100.0
-            
-            x1 = int(x_abs - width_abs / 2)
-            y1 = int(y_abs - height_abs / 2)
-            x2 = int(x_abs + width_abs / 2)
-            y2 = int(y_abs + height_abs / 2)
-            
-            # Обеспечиваем границы изображения
-            x1 = max(0, min(x1, image_width))
-            y1 = max(0, min(y1, image_height))
-            x2 = max(0, min(x2, image_width))
-            y2 = max(0, min(y2, image_height))
-            
-            detections.append({
-                "class": class_name,
-                "confidence": round(confidence, 2),
-                "bbox": [x1, y1, x2, y2]
-            })
-        
-        return detections
-    
-    def _stub_detection(self, image: np.ndarray) -> list:
-        """Заглушка для демонстрации"""
-        if isinstance(image, Image.Image):
-            width, height = image.size
-        else:
-            if len(image.shape) == 3:
-                height, width = image.shape[:2]
-            else:
-                height, width = image.shape
-        
-        detections = []
-        num_detections = random.randint(1, 3)
-        
-        for i in range(num_detections):
-            w = random.randint(100, min(300, width-1))
-            h = random.randint(100, min(400, height-1))
-            x = random.randint(0, max(1, width - w))
-            y = random.randint(0, max(1, height - h))
-            
-            detections.append({
-                "class": random.choice(self.classes),
-                "confidence": round(random.uniform(0.3, 0.7), 2),  # Пониженная уверенность для заглушки
-                "bbox": [x, y, x + w, y + h]
-            })
-        
-        return detections
+        # Перевод координат, фильтрация и NMS выполняются над массивами целиком,
+        # чтобы дальнейший анализ ROI шел только по реальным объектам
+        return postprocess_predictions(
+            result['predictions'],
+            image_width,
+            image_height,
+            score_threshold=settings.detection_score_threshold,
+            iou_threshold=settings.detection_iou_threshold,
+            top_k=settings.detection_top_k or None,
+        )
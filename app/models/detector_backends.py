@@ -0,0 +1,282 @@
+
+import asyncio
+import io
+import os
+import random
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.models.roboflow_client import RoboflowClient, CircuitBreaker
+from app.utils import seeded_digest
+
+
+class DetectorBackend:
+    """
+    Интерфейс бэкенда детекции для TreeDetector.
+
+    infer/infer_batch возвращают "сырой" результат в формате Roboflow API:
+    {"predictions": [{"x", "y", "width", "height", "confidence", "class"}, ...]},
+    координаты - в процентах от размера изображения (как ожидает
+    TreeDetector._process_predictions).
+    """
+
+    name = "base"
+    # Можно ли кэшировать результаты (заглушку не кэшируем)
+    cacheable = True
+    # Обрабатывает ли infer_batch батч одним вызовом модели: только тогда
+    # микробатчинг одновременных запросов дает выигрыш
+    supports_batching = False
+    model_id = None
+
+    def preload(self):
+        """Подготовка до fork воркеров (чтение весов); без потоков, event loop и сокетов"""
+
+    def load(self):
+        """Синхронная инициализация (сессии, клиенты); вызывается при старте воркера"""
+
+    async def warmup(self):
+        """Пробный инференс, чтобы первый настоящий запрос не платил за прогрев"""
+
+    async def infer(self, image_bytes: bytes, image_size: Tuple[int, int], confidence_threshold: float) -> dict:
+        raise NotImplementedError
+
+    async def infer_batch(self, items: List[Tuple[bytes, Tuple[int, int]]], confidence_threshold: float) -> List[dict]:
+        """
+        По умолчанию - параллельные одиночные вызовы; бэкенды с батчингом переопределяют.
+        Ошибка одного изображения возвращается исключением на его месте.
+        """
+        return await asyncio.gather(
+            *(self.infer(image_bytes, image_size, confidence_threshold) for image_bytes, image_size in items),
+            return_exceptions=True
+        )
+
+    async def close(self):
+        pass
+
+    def status(self) -> dict:
+        return {}
+
+
+class RoboflowBackend(DetectorBackend):
+    """Удаленный инференс через Roboflow API"""
+
+    name = "roboflow"
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.model_id = settings.detector_model_id
+        self.client = None
+
+    def load(self):
+        if not self.settings.roboflow_api_key:
+            raise RuntimeError("ROBOFLOW_API_KEY is not set")
+        # Клиент создается внутри работающего event loop (startup-хук)
+        self.client = RoboflowClient(
+            api_url=self.settings.roboflow_api_url,
+            api_key=self.settings.roboflow_api_key,
+            timeout=self.settings.detector_timeout,
+            connect_timeout=self.settings.detector_connect_timeout,
+            max_connections=self.settings.detector_max_connections,
+            max_concurrency=self.settings.detector_max_concurrency,
+            retries=self.settings.detector_retries,
+            backoff_base=self.settings.detector_backoff_base,
+            breaker=CircuitBreaker(
+                failure_threshold=self.settings.detector_breaker_threshold,
+                reset_timeout=self.settings.detector_breaker_reset,
+            ),
+        )
+
+    async def infer(self, image_bytes, image_size, confidence_threshold):
+        return await self.client.infer(image_bytes, self.model_id, confidence_threshold)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+    def status(self) -> dict:
+        return self.client.status() if self.client is not None else {}
+
+
+class OnnxBackend(DetectorBackend):
+    """
+    Локальный CPU-инференс через ONNX Runtime (требуется пакет onnxruntime).
+
+    Ожидается детектор в формате экспорта YOLOv8: вход (N, 3, H, W) float32 в [0, 1],
+    выход (N, 4 + число классов, кандидаты) с боксами cx, cy, w, h в пикселях входа.
+    Сессия создается один раз при старте; батч изображений идет одним тензором,
+    если модель допускает динамический размер батча.
+    """
+
+    name = "onnx"
+    supports_batching = True
+
+    def __init__(self, settings):
+        self.model_path = settings.onnx_model_path
+        self.model_id = f"onnx:{os.path.basename(self.model_path or '')}"
+        self.intra_op_threads = settings.onnx_intra_op_threads
+        self.class_names = settings.onnx_class_names
+        self.max_detections = settings.onnx_max_detections
+        self.default_input_size = settings.onnx_input_size
+        self.model_bytes = None
+        self.session = None
+        self.input_name = None
+        self.input_width = None
+        self.input_height = None
+        self.dynamic_batch = False
+
+    def preload(self):
+        # Веса читаются один раз в мастер-процессе и разделяются воркерами после fork;
+        # сессия ONNX Runtime (со своими потоками) создается уже в воркере
+        if self.model_path and os.path.exists(self.model_path):
+            with open(self.model_path, "rb") as f:
+                self.model_bytes = f.read()
+
+    def load(self):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("DETECTOR_BACKEND=onnx requires the onnxruntime package")
+        if self.model_bytes is None and (not self.model_path or not os.path.exists(self.model_path)):
+            raise RuntimeError(f"ONNX model not found: {self.model_path}")
+
+        options = ort.SessionOptions()
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model = self.model_bytes if self.model_bytes is not None else self.model_path
+        self.session = ort.InferenceSession(model, sess_options=options, providers=["CPUExecutionProvider"])
+        self.model_bytes = None
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, width = model_input.shape
+        # Нефиксированные размерности в ONNX приходят строками или None
+        self.dynamic_batch = not isinstance(batch, int)
+        self.input_height = height if isinstance(height, int) else self.default_input_size
+        self.input_width = width if isinstance(width, int) else self.default_input_size
+
+    async def warmup(self):
+        dummy = np.zeros((1, 3, self.input_height, self.input_width), dtype=np.float32)
+        await asyncio.to_thread(self.session.run, None, {self.input_name: dummy})
+
+    async def infer(self, image_bytes, image_size, confidence_threshold):
+        results = await self.infer_batch([(image_bytes, image_size)], confidence_threshold)
+        return results[0]
+
+    async def infer_batch(self, items, confidence_threshold):
+        # onnxruntime отпускает GIL, поэтому инференс выполняется в отдельном потоке
+        return await asyncio.to_thread(self._infer_batch_sync, [image_bytes for image_bytes, _ in items],
+                                       confidence_threshold)
+
+    def _infer_batch_sync(self, images: List[bytes], confidence_threshold: float) -> List[dict]:
+        batch = np.empty((len(images), 3, self.input_height, self.input_width), dtype=np.float32)
+        for i, image_bytes in enumerate(images):
+            self._preprocess(image_bytes, out=batch[i])
+
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: batch})[0]
+        else:
+            outputs = np.concatenate(
+                [self.session.run(None, {self.input_name: batch[i:i + 1]})[0] for i in range(len(images))]
+            )
+        return [self._decode(output, confidence_threshold) for output in outputs]
+
+    def _preprocess(self, image_bytes: bytes, out: np.ndarray):
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Для JPEG декодируем сразу в уменьшенном масштабе
+            image.draft("RGB", (self.input_width, self.input_height))
+            image = image.convert("RGB").resize((self.input_width, self.input_height), Image.BILINEAR)
+            pixels = np.asarray(image, dtype=np.float32)
+        # HWC -> CHW с нормализацией в [0, 1] прямо в слот батча
+        np.multiply(pixels.transpose(2, 0, 1), 1.0 / 255.0, out=out)
+
+    def _decode(self, output: np.ndarray, confidence_threshold: float) -> dict:
+        # (4 + классы, кандидаты); некоторые экспорты отдают транспонированный вариант
+        if output.shape[0] > output.shape[1]:
+            output = output.T
+        class_scores = output[4:]
+        class_ids = class_scores.argmax(axis=0)
+        scores = class_scores.max(axis=0)
+
+        candidates = np.flatnonzero(scores >= confidence_threshold)
+        candidates = candidates[np.argsort(-scores[candidates])][:self.max_detections]
+
+        # Пиксели входа модели -> проценты от размера изображения
+        scale = np.array([self.input_width, self.input_height, self.input_width, self.input_height], dtype=np.float32)
+        boxes = output[:4, candidates].T / scale * 100.0
+
+        predictions = []
+        for (x, y, width, height), score, class_id in zip(boxes.tolist(), scores[candidates].tolist(),
+                                                          class_ids[candidates].tolist()):
+            predictions.append({
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "confidence": score,
+                "class": self.class_names[class_id] if class_id < len(self.class_names) else str(class_id),
+            })
+        return {"predictions": predictions}
+
+    def status(self) -> dict:
+        return {
+            "model_path": self.model_path,
+            "input_size": [self.input_width, self.input_height],
+            "dynamic_batch": self.dynamic_batch,
+            "intra_op_threads": self.intra_op_threads,
+        }
+
+
+class StubBackend(DetectorBackend):
+    """
+    Заглушка для демонстрации: случайные боксы.
+    С seed боксы выводятся из хэша байтов изображения - одинаковые для
+    одинаковых изображений, поэтому результат можно кэшировать.
+    """
+
+    name = "stub"
+    cacheable = False
+    model_id = "stub"
+
+    def __init__(self, classes: Optional[List[str]] = None, seed: Optional[int] = None):
+        self.classes = classes or ["tree", "shrub"]
+        self.seed = seed
+        if seed is not None:
+            self.cacheable = True
+            self.model_id = f"stub:{seed}"
+
+    async def infer(self, image_bytes, image_size, confidence_threshold):
+        width, height = image_size
+        rng = random if self.seed is None else random.Random(seeded_digest(self.seed, image_bytes))
+
+        predictions = []
+        num_detections = rng.randint(1, 3)
+
+        for i in range(num_detections):
+            w = rng.randint(100, min(300, width-1))
+            h = rng.randint(100, min(400, height-1))
+            x = rng.randint(0, max(1, width - w))
+            y = rng.randint(0, max(1, height - h))
+
+            predictions.append({
+                "x": (x + w / 2) * 100.0 / width,
+                "y": (y + h / 2) * 100.0 / height,
+                "width": w * 100.0 / width,
+                "height": h * 100.0 / height,
+                "class": rng.choice(self.classes),
+                "confidence": round(rng.uniform(0.3, 0.7), 2),  # Пониженная уверенность для заглушки
+            })
+
+        return {"predictions": predictions}
+
+
+def create_backend(name: str, settings) -> DetectorBackend:
+    if name == "roboflow":
+        return RoboflowBackend(settings)
+    if name == "onnx":
+        return OnnxBackend(settings)
+    if name == "stub":
+        return StubBackend(seed=settings.analysis_seed if settings.deterministic else None)
+    raise ValueError(f"Unknown detector backend: {name}")
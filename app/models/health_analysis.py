@@ -1,21 +1,59 @@
 
-import random
+import numpy as np
 from PIL import Image
 
+from app.models.roi_batch import image_to_batch
+from app.utils import seeded_digest
+
+# Признаки "да/нет" и пороги заглушки: признак есть, если случайное значение больше порога
+HEALTH_FLAGS = (
+    ("trunk_rot", 0.7),
+    ("hollow", 0.8),
+    ("trunk_crack", 0.6),
+    ("trunk_damage", 0.5),
+    ("crown_damage", 0.4),
+    ("fruiting_bodies", 0.9),
+)
+
 class HealthAnalyzer:
-    def __init__(self):
-        pass
+    # Сторона квадратного входа анализатора (ROI масштабируются до нее)
+    input_size = 64
+
+    def __init__(self, seed: int = None):
+        """seed задан - детерминированный режим: значения выводятся из хэша ROI и seed"""
+        self.seed = seed
+        self.thresholds = np.array([threshold for _, threshold in HEALTH_FLAGS])
+        self.rng = np.random.default_rng()
     
     def analyze_health(self, image: Image.Image, tree_type: str) -> dict:
+        return self.analyze_health_batch(image_to_batch(image, self.input_size), [tree_type])[0]
+    
+    def analyze_health_batch(self, batch: np.ndarray, tree_types: list) -> list:
+        """
+        Анализ состояния для батча ROI (N, input_size, input_size, 3) float32 в [0, 1]
+        и типов объектов детектора; все признаки считаются одним проходом.
+        """
         # Заглушка для анализа здоровья растения
         # В реальной реализации здесь будет сложная модель анализа
-        return {
-            "trunk_rot": "да" if random.random() > 0.7 else "нет",
-            "hollow": "да" if random.random() > 0.8 else "нет",
-            "trunk_crack": "да" if random.random() > 0.6 else "нет",
-            "trunk_damage": "да" if random.random() > 0.5 else "нет",
-            "crown_damage": "да" if random.random() > 0.4 else "нет",
-            "fruiting_bodies": "да" if random.random() > 0.9 else "нет",
-            "dried_branches_percent": random.randint(0, 50),
-            "other_characteristics": "Некоторые дополнительные характеристики"
-        }
+        values = self._uniform(batch, tree_types, len(HEALTH_FLAGS) + 1)
+        flags = values[:, :len(HEALTH_FLAGS)] > self.thresholds
+        dried = (values[:, -1] * 51).astype(np.int64)
+        
+        results = []
+        for row, dried_percent in zip(flags.tolist(), dried.tolist()):
+            result = {name: "да" if flag else "нет" for (name, _), flag in zip(HEALTH_FLAGS, row)}
+            result["dried_branches_percent"] = dried_percent
+            result["other_characteristics"] = "Некоторые дополнительные характеристики"
+            results.append(result)
+        return results
+    
+    def _uniform(self, batch: np.ndarray, tree_types: list, columns: int) -> np.ndarray:
+        """Значения в [0, 1) размера (N, columns): случайные или из хэша содержимого ROI"""
+        if self.seed is None:
+            return self.rng.random((len(batch), columns))
+        digests = b"".join(
+            seeded_digest(self.seed, roi.tobytes(), tree_type.encode(), digest_size=4 * columns)
+            for roi, tree_type in zip(batch, tree_types)
+        )
+        words = np.frombuffer(digests, dtype="<u4").reshape(len(batch), columns)
+        return words / 2.0 ** 32
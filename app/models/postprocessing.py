@@ -0,0 +1,125 @@
+
+from typing import List, Tuple
+
+import numpy as np
+
+
+def predictions_to_arrays(predictions: List[dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """
+    Переводит список предсказаний Roboflow в массивы:
+    боксы (N, 4) в формате [x, y, width, height], уверенности (N,),
+    индексы классов (N,) и список имен классов.
+    """
+    count = len(predictions)
+    boxes = np.empty((count, 4), dtype=np.float64)
+    scores = np.empty(count, dtype=np.float64)
+    class_names = []
+    class_index = {}
+    class_ids = np.empty(count, dtype=np.int64)
+
+    for i, prediction in enumerate(predictions):
+        boxes[i] = (
+            prediction.get('x', 0),
+            prediction.get('y', 0),
+            prediction.get('width', 0),
+            prediction.get('height', 0),
+        )
+        scores[i] = prediction.get('confidence', 0)
+        class_name = prediction.get('class', 'unknown')
+        if class_name not in class_index:
+            class_index[class_name] = len(class_names)
+            class_names.append(class_name)
+        class_ids[i] = class_index[class_name]
+
+    return boxes, scores, class_ids, class_names
+
+
+def center_percent_to_xyxy(boxes: np.ndarray, image_width: int, image_height: int) -> np.ndarray:
+    """
+    [x, y, width, height] центра бокса в процентах от размера изображения ->
+    целочисленные [x1, y1, x2, y2] в пикселях, обрезанные по границам изображения.
+    """
+    scale = np.array([image_width, image_height, image_width, image_height], dtype=np.float64) / 100.0
+    absolute = boxes * scale
+    half = absolute[:, 2:] / 2
+    xyxy = np.concatenate([absolute[:, :2] - half, absolute[:, :2] + half], axis=1)
+    # Отбрасываем дробную часть так же, как int(), затем обрезаем по границам
+    xyxy = np.trunc(xyxy)
+    np.clip(xyxy[:, 0::2], 0, image_width, out=xyxy[:, 0::2])
+    np.clip(xyxy[:, 1::2], 0, image_height, out=xyxy[:, 1::2])
+    return xyxy.astype(np.int64)
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """IoU одного бокса [x1, y1, x2, y2] со всеми боксами (N, 4)"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area + areas - intersection
+    return np.divide(intersection, union, out=np.zeros_like(union, dtype=np.float64), where=union > 0)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float, top_k: int = None) -> np.ndarray:
+    """
+    Жадное подавление немаксимумов. Возвращает индексы оставленных боксов
+    по убыванию уверенности (не больше top_k).
+    """
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size > 0:
+        current = order[0]
+        keep.append(current)
+        if top_k is not None and len(keep) >= top_k:
+            break
+        rest = order[1:]
+        order = rest[box_iou(boxes[current], boxes[rest]) <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def class_aware_nms(boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray,
+                    iou_threshold: float, top_k: int = None) -> np.ndarray:
+    """NMS внутри каждого класса: боксы разных классов друг друга не подавляют"""
+    if boxes.size == 0:
+        return np.empty(0, dtype=np.int64)
+    # Сдвигаем боксы каждого класса в свою непересекающуюся область координат
+    offset = float(boxes.max()) + 1.0
+    shifted = boxes.astype(np.float64) + (class_ids * offset)[:, None]
+    return nms(shifted, scores, iou_threshold, top_k)
+
+
+def postprocess_predictions(predictions: List[dict], image_width: int, image_height: int,
+                            score_threshold: float = 0.0, iou_threshold: float = 0.5,
+                            top_k: int = None) -> List[dict]:
+    """
+    Векторизованная постобработка предсказаний детектора:
+    перевод координат, фильтр по уверенности, отбрасывание вырожденных боксов,
+    NMS по классам и ограничение top_k. iou_threshold >= 1 отключает NMS.
+    """
+    if not predictions:
+        return []
+
+    boxes, scores, class_ids, class_names = predictions_to_arrays(predictions)
+    xyxy = center_percent_to_xyxy(boxes, image_width, image_height)
+
+    valid = (scores >= score_threshold) & (xyxy[:, 2] > xyxy[:, 0]) & (xyxy[:, 3] > xyxy[:, 1])
+    indices = np.flatnonzero(valid)
+
+    if iou_threshold < 1.0:
+        kept = class_aware_nms(xyxy[indices], scores[indices], class_ids[indices], iou_threshold, top_k)
+    else:
+        kept = np.argsort(-scores[indices], kind="stable")[:top_k]
+    indices = indices[kept]
+
+    return [
+        {
+            "class": class_names[class_id],
+            "confidence": round(score, 2),
+            "bbox": bbox,
+        }
+        for class_id, score, bbox in zip(class_ids[indices].tolist(), scores[indices].tolist(),
+                                         xyxy[indices].tolist())
+    ]
@@ -0,0 +1,164 @@
+
+import asyncio
+import base64
+import random
+import time
+from typing import Optional
+
+import httpx
+
+
+class DetectorUnavailable(Exception):
+    """Детектор недоступен: сеть, ошибки API или открыт circuit breaker"""
+
+
+class CircuitBreaker:
+    """
+    Простой circuit breaker.
+
+    После failure_threshold подряд неудачных вызовов переходит в состояние "open"
+    и reset_timeout секунд сразу отклоняет запросы. Затем пропускает один пробный
+    запрос ("half_open"): успех закрывает breaker, ошибка снова открывает.
+    Пробный запрос без исхода (отменен по дедлайну) освобождает место для следующего.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_progress:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+
+    def release_trial(self):
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_progress or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_in_progress = False
+
+
+class RoboflowClient:
+    """
+    Асинхронный клиент Roboflow inference API (формат serverless / hosted API v0).
+
+    Использует один httpx.AsyncClient с пулом keep-alive соединений,
+    ограничивает число одновременных запросов, повторяет запрос при сетевых
+    ошибках, 429 и 5xx с экспоненциальной задержкой и джиттером.
+    api_url можно направить на локальный стенд (tools/fake_inference_server.py).
+    """
+
+    def __init__(self, api_url: str, api_key: str, timeout: float = 10.0, connect_timeout: float = 3.0,
+                 max_connections: int = 20, max_concurrency: int = 16, retries: int = 2,
+                 backoff_base: float = 0.2, breaker: Optional[CircuitBreaker] = None):
+        self.api_url = api_url.rstrip("/")
+        self.api_key = api_key
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.requests_sent = 0
+        self.retries_done = 0
+        self.failures = 0
+
+    async def infer(self, image_bytes: bytes, model_id: str, confidence_threshold: float) -> dict:
+        """Отправляет исходные байты изображения на инференс, возвращает JSON ответа"""
+        is_trial = self.breaker.state == "half_open"
+        if not self.breaker.allow():
+            raise DetectorUnavailable(
+                f"Detector circuit is open, retry in {self.breaker.retry_after():.0f}s"
+            )
+
+        url = f"{self.api_url}/{model_id}"
+        params = {"api_key": self.api_key, "confidence": confidence_threshold}
+        payload = base64.b64encode(image_bytes)
+        last_error = None
+
+        outcome_recorded = False
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt > 0:
+                    self.retries_done += 1
+                    # Экспоненциальная задержка с полным джиттером
+                    await asyncio.sleep(random.uniform(0, self.backoff_base * (2 ** attempt)))
+                try:
+                    async with self._semaphore:
+                        self.requests_sent += 1
+                        response = await self._http.post(
+                            url,
+                            params=params,
+                            content=payload,
+                            headers={"Content-Type": "application/x-www-form-urlencoded"},
+                        )
+                except httpx.TransportError as e:
+                    last_error = f"{type(e).__name__}: {e}"
+                    continue
+
+                if response.status_code == 429 or response.status_code >= 500:
+                    last_error = f"HTTP {response.status_code}"
+                    continue
+                if response.status_code >= 400:
+                    # Ошибки клиента (плохое изображение, слишком большой запрос) не повторяем
+                    # и не считаем сбоем детектора: API ответил, breaker не открываем
+                    self.failures += 1
+                    self.breaker.record_success()
+                    outcome_recorded = True
+                    raise DetectorUnavailable(
+                        f"Detector request failed: HTTP {response.status_code}: {response.text[:200]}"
+                    )
+
+                self.breaker.record_success()
+                outcome_recorded = True
+                return response.json()
+
+            self.failures += 1
+            self.breaker.record_failure()
+            outcome_recorded = True
+            raise DetectorUnavailable(f"Detector request failed: {last_error}")
+        finally:
+            if is_trial and not outcome_recorded:
+                self.breaker.release_trial()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    def status(self) -> dict:
+        return {
+            "api_url": self.api_url,
+            "circuit_state": self.breaker.state,
+            "requests_sent": self.requests_sent,
+            "retries": self.retries_done,
+            "failures": self.failures,
+        }
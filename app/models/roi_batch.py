@@ -0,0 +1,60 @@
+
+from typing import List, Tuple
+
+import numpy as np
+
+from app.utils import rgb_pixels
+
+
+def roi_boxes(detections: List[dict], image_width: int, image_height: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Боксы детекций [x1, y1, x2, y2], обрезанные по границам изображения.
+    Возвращает (боксы (M, 4), индексы детекций (M,)) только для невырожденных боксов.
+    """
+    if not detections:
+        return np.empty((0, 4), dtype=np.int64), np.empty(0, dtype=np.int64)
+    boxes = np.array([detection["bbox"] for detection in detections], dtype=np.float64)
+    boxes = np.trunc(boxes).astype(np.int64)
+    np.clip(boxes[:, 0::2], 0, image_width, out=boxes[:, 0::2])
+    np.clip(boxes[:, 1::2], 0, image_height, out=boxes[:, 1::2])
+    valid = np.flatnonzero((boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1]))
+    return boxes[valid], valid
+
+
+def extract_roi_batch(pixels: np.ndarray, boxes: np.ndarray, size: int) -> np.ndarray:
+    """
+    Собирает ROI одного изображения в батч (N, size, size, 3) float32 в [0, 1].
+
+    pixels - массив (H, W, 3) uint8 всего изображения; каждый ROI берется как
+    срез-представление без копирования и масштабируется (ближайший сосед)
+    прямо в свой слот заранее выделенного тензора.
+    """
+    batch = np.empty((len(boxes), size, size, 3), dtype=np.float32)
+    for i, (x1, y1, x2, y2) in enumerate(boxes.tolist()):
+        _resize_into(pixels[y1:y2, x1:x2], batch[i])
+    return batch
+
+
+def crops_to_batch(crops: List[np.ndarray], size: int) -> np.ndarray:
+    """Батч (N, size, size, 3) float32 из отдельных кропов (H, W, 3) uint8 разного размера"""
+    batch = np.empty((len(crops), size, size, 3), dtype=np.float32)
+    for i, crop in enumerate(crops):
+        _resize_into(crop, batch[i])
+    return batch
+
+
+def _resize_into(view: np.ndarray, out: np.ndarray):
+    """Масштабирование (ближайший сосед) uint8-кропа в слот батча с нормировкой в [0, 1]"""
+    size = out.shape[0]
+    # Центры пикселей результата в долях стороны ROI
+    grid = (np.arange(size, dtype=np.float64) + 0.5) / size
+    rows = (grid * view.shape[0]).astype(np.intp)
+    cols = (grid * view.shape[1]).astype(np.intp)
+    np.multiply(view[rows[:, None], cols], 1.0 / 255.0, out=out, casting="unsafe")
+
+
+def image_to_batch(image, size: int) -> np.ndarray:
+    """Батч из одного PIL-изображения (целиком)"""
+    pixels = rgb_pixels(image)
+    height, width = pixels.shape[:2]
+    return extract_roi_batch(pixels, np.array([[0, 0, width, height]]), size)
@@ -0,0 +1,253 @@
+
+import io
+import time
+from typing import Union
+
+from PIL import Image
+
+from app.config import settings
+from app.cache import DetectionCache
+from app.metrics import StageTimer
+from app.utils import (
+    decode_base64, decode_image, image_to_base64, draw_detections_pil, DecodedImage, configure_pil_limit, rgb_pixels
+)
+from app.models.detection_model import TreeDetector
+from app.models.classification_model import TreeClassifier
+from app.models.health_analysis import HealthAnalyzer
+from app.models.roi_batch import roi_boxes, extract_roi_batch, crops_to_batch
+
+# Защита PIL от decompression bomb - по самому большому из наших лимитов
+# (ортофото потайлового анализа больше стандартных ~179 Мпикс); размер
+# изображения каждый путь декодирования проверяет сам
+configure_pil_limit(
+    max(settings.max_image_pixels, settings.tile_max_pixels)
+    if settings.max_image_pixels and settings.tile_max_pixels else 0
+)
+
+# Кэш детекций по содержимому изображения
+detection_cache = None
+if settings.detection_cache_size > 0:
+    detection_cache = DetectionCache(
+        max_entries=settings.detection_cache_size,
+        ttl_seconds=settings.detection_cache_ttl,
+        disk_path=settings.detection_cache_path,
+    )
+
+# Инициализация моделей.
+# Детектор работает в основном процессе (асинхронные сетевые вызовы),
+# классификатор и анализ состояния - в пуле воркеров; в режиме process-пула
+# каждый процесс-воркер получает свои экземпляры.
+detector = TreeDetector(cache=detection_cache)
+classifier = TreeClassifier(seed=settings.analysis_seed)
+health_analyzer = HealthAnalyzer(seed=settings.analysis_seed if settings.deterministic else None)
+
+
+def load_image(image_data: Union[str, bytes]) -> DecodedImage:
+    """
+    Принимает base64-строку или исходные байты файла и декодирует изображение
+    с ограничениями по размеру сразу в рабочее разрешение детектора
+    (с учетом EXIF-ориентации). Пиксели декодируются один раз и используются
+    и для детекции, и для кропа ROI, и для отрисовки.
+    """
+    timer = StageTimer()
+    if isinstance(image_data, str):
+        with timer.stage("base64_decode"):
+            image_bytes = decode_base64(image_data)
+    else:
+        image_bytes = image_data
+
+    with timer.stage("image_decode"):
+        decoded = decode_image(
+            image_bytes,
+            max_bytes=settings.max_image_bytes,
+            max_pixels=settings.max_image_pixels,
+            max_side=settings.detector_input_size,
+        )
+    decoded.timings = timer.timings
+    return decoded
+
+
+def crop_roi(pil_image, detection: dict):
+    """Вырезает регион объекта; None, если бокс вырожден или за границами изображения"""
+    # Извлечение региона для анализа
+    x1, y1, x2, y2 = map(int, detection["bbox"])
+    # Обеспечиваем, чтобы координаты не выходили за границы
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(pil_image.width, x2), min(pil_image.height, y2)
+
+    if x2 > x1 and y2 > y1:
+        # Используем PIL для извлечения ROI
+        return pil_image.crop((x1, y1, x2, y2))
+    return None
+
+
+def crop_rois(pil_image, detections: list) -> list:
+    """Пары (tree_id, ROI) для всех невырожденных боксов"""
+    rois = []
+    for i, detection in enumerate(detections):
+        roi = crop_roi(pil_image, detection)
+        if roi is not None:
+            rois.append((i + 1, roi))
+    return rois
+
+
+def _tree_result(tree_id: int, detection: dict, species: str, health_data: dict) -> dict:
+    return {
+        "tree_id": tree_id,
+        "characteristics": {
+            "species": species,
+            "trunk_rot": health_data.get("trunk_rot"),
+            "hollow": health_data.get("hollow"),
+            "trunk_crack": health_data.get("trunk_crack"),
+            "trunk_damage": health_data.get("trunk_damage"),
+            "crown_damage": health_data.get("crown_damage"),
+            "fruiting_bodies": health_data.get("fruiting_bodies"),
+            "dried_branches_percent": health_data.get("dried_branches_percent"),
+            "other_characteristics": health_data.get("other_characteristics"),
+        },
+        "detection_confidence": detection["confidence"],
+        "object_type": detection["class"],
+    }
+
+
+def analyze_roi(roi, detection: dict, tree_id: int, timer: StageTimer = None) -> dict:
+    """Классификация породы и анализ состояния одного объекта"""
+    timer = timer or StageTimer()
+
+    # Классификация породы
+    with timer.stage("classification"):
+        species = classifier.predict_species(roi)
+
+    # Анализ состояния
+    with timer.stage("health"):
+        health_data = health_analyzer.analyze_health(roi, detection["class"])
+
+    return _tree_result(tree_id, detection, species, health_data)
+
+
+def analyze_tree(roi, detection: dict, tree_id: int) -> dict:
+    """Анализ одного объекта задачей пула (для потоковой выдачи): результат и времена этапов"""
+    timer = StageTimer()
+    return {"result": analyze_roi(roi, detection, tree_id, timer), "timings": timer.timings}
+
+
+def analyze_rois(pil_image, detections: list, timer: StageTimer = None) -> list:
+    """
+    Классификация породы и анализ состояния для всех обнаруженных объектов.
+    ROI берутся срезами одного массива пикселей изображения и собираются
+    в батч, который модели обрабатывают за один вызов.
+    """
+    return analyze_pixels(rgb_pixels(pil_image), detections, timer)
+
+
+def analyze_pixels(pixels, detections: list, timer: StageTimer = None) -> list:
+    """
+    То же для массива пикселей (H, W, 3) uint8; подходит и для np.memmap -
+    с диска читаются только строки, попадающие в ROI
+    """
+    timer = timer or StageTimer()
+    with timer.stage("roi_extract"):
+        height, width = pixels.shape[:2]
+        boxes, indices = roi_boxes(detections, width, height)
+        batch = extract_roi_batch(pixels, boxes, classifier.input_size)
+        health_batch = batch
+        if health_analyzer.input_size != classifier.input_size:
+            health_batch = extract_roi_batch(pixels, boxes, health_analyzer.input_size)
+    if not len(boxes):
+        return []
+
+    valid = [detections[i] for i in indices.tolist()]
+
+    # Классификация породы
+    with timer.stage("classification"):
+        species = classifier.predict_species_batch(batch)
+
+    # Анализ состояния
+    with timer.stage("health"):
+        health = health_analyzer.analyze_health_batch(health_batch, [detection["class"] for detection in valid])
+
+    return [
+        _tree_result(i + 1, detection, species_name, health_data)
+        for i, detection, species_name, health_data in zip(indices.tolist(), valid, species, health)
+    ]
+
+
+def analyze_crops(crops: list, detections: list) -> dict:
+    """
+    Анализ готовых кропов (H, W, 3) uint8 - по одному на объект, например
+    лучший кадр трека видео. Возвращает результаты и времена этапов.
+    """
+    timer = StageTimer()
+    if not crops:
+        return {"results": [], "timings": timer.timings}
+    with timer.stage("roi_extract"):
+        batch = crops_to_batch(crops, classifier.input_size)
+        health_batch = batch
+        if health_analyzer.input_size != classifier.input_size:
+            health_batch = crops_to_batch(crops, health_analyzer.input_size)
+
+    with timer.stage("classification"):
+        species = classifier.predict_species_batch(batch)
+
+    with timer.stage("health"):
+        health = health_analyzer.analyze_health_batch(health_batch, [detection["class"] for detection in detections])
+
+    results = [
+        _tree_result(i + 1, detection, species_name, health_data)
+        for i, (detection, species_name, health_data) in enumerate(zip(detections, species, health))
+    ]
+    return {"results": results, "timings": timer.timings}
+
+
+def analyze_decoded(decoded: DecodedImage, detections: list, render: bool = True) -> dict:
+    """
+    CPU-bound часть анализа после детекции: анализ ROI и отрисовка.
+    Детекции - в координатах рабочего изображения.
+    Выполняется в пуле воркеров, чтобы не блокировать event loop.
+    Возвращает простые dict-структуры, чтобы результат можно было передать из другого процесса.
+    """
+    timer = StageTimer()
+    results = analyze_rois(decoded.image, detections, timer)
+
+    return {
+        "results": results,
+        "processed_image": render_image(decoded.image, detections, timer) if render else None,
+        "objects_detected": len(detections),
+        # Времена этапов возвращаются вызывающему: воркер может быть другим процессом
+        "timings": timer.timings,
+    }
+
+
+def render_decoded(decoded: DecodedImage, detections: list) -> dict:
+    """Отрисовка задачей пула: base64 JPEG и времена этапов"""
+    timer = StageTimer()
+    return {"processed_image": render_image(decoded.image, detections, timer), "timings": timer.timings}
+
+
+def render_image(pil_image, detections: list, timer: StageTimer = None) -> str:
+    """Рисует bounding boxes и кодирует результат в base64 JPEG"""
+    timer = timer or StageTimer()
+    with timer.stage("render"):
+        processed_image = draw_detections_pil(pil_image, detections)
+    with timer.stage("encode"):
+        return image_to_base64(processed_image)
+
+
+def warmup_image() -> bytes:
+    """Синтетическое JPEG-изображение для прогрева"""
+    buffered = io.BytesIO()
+    Image.new("RGB", (640, 480), color=(120, 160, 90)).save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+def warmup_pipeline() -> float:
+    """
+    Прогоняет синтетическое изображение через декодирование, анализ ROI и
+    отрисовку, чтобы первый настоящий запрос не платил за холодный воркер.
+    Возвращает время прогона в секундах.
+    """
+    start_time = time.perf_counter()
+    decoded = load_image(warmup_image())
+    detections = [{"class": "tree", "confidence": 0.5, "bbox": [100, 100, 300, 400]}]
+    analyze_decoded(decoded, detections, render=True)
+    return time.perf_counter() - start_time
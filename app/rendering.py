@@ -0,0 +1,124 @@
+
+import io
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from app.utils import open_bounded, draw_detections_pil
+
+RENDER_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+class LRUStore:
+    """
+    Потокобезопасный LRU-словарь с ограничением суммарного размера (в байтах) и TTL.
+    Размер записи передается при вставке.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at <= time.time():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size: int):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class RenderStore:
+    """
+    Отложенная отрисовка: хранит исходные байты изображения и детекции под
+    выданным идентификатором, а готовые картинки кэширует по
+    (идентификатор, формат, качество, максимальный размер).
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, rendered_max_bytes: int):
+        self.sources = LRUStore(max_bytes, ttl_seconds)
+        self.rendered = LRUStore(rendered_max_bytes, ttl_seconds)
+
+    def put(self, image_bytes: bytes, detections: list) -> str:
+        render_id = uuid.uuid4().hex
+        self.sources.put(render_id, (image_bytes, detections), len(image_bytes))
+        return render_id
+
+    def get_source(self, render_id: str):
+        return self.sources.get(render_id)
+
+    def get_rendered(self, key: tuple) -> Optional[bytes]:
+        return self.rendered.get(key)
+
+    def put_rendered(self, key: tuple, content: bytes):
+        self.rendered.put(key, content, len(content))
+
+    def stats(self) -> dict:
+        return {"sources": self.sources.stats(), "rendered": self.rendered.stats()}
+
+
+def render_annotated(image_bytes: bytes, detections: list, image_format: str = "jpeg",
+                     quality: int = 85, max_dim: int = 0, max_pixels: int = 0) -> bytes:
+    """
+    Рисует детекции на изображении и кодирует его в JPEG/WebP.
+    max_dim > 0 ограничивает большую сторону результата; для JPEG уменьшение
+    выполняется уже при декодировании (draft), боксы масштабируются.
+    """
+    pil_format, _ = RENDER_FORMATS[image_format]
+    # Боксы заданы в координатах исходного изображения с учетом EXIF-ориентации
+    image, (original_width, original_height), _, _ = open_bounded(image_bytes, max_pixels=max_pixels, max_side=max_dim)
+
+    if image.size != (original_width, original_height):
+        scale_x = image.width / original_width
+        scale_y = image.height / original_height
+        detections = [
+            dict(detection, bbox=[
+                detection["bbox"][0] * scale_x, detection["bbox"][1] * scale_y,
+                detection["bbox"][2] * scale_x, detection["bbox"][3] * scale_y,
+            ])
+            for detection in detections
+        ]
+
+    annotated = draw_detections_pil(image, detections)
+    buffered = io.BytesIO()
+    annotated.save(buffered, format=pil_format, quality=quality)
+    return buffered.getvalue()
@@ -1,131 +1,561 @@
-from fastapi import APIRouter, HTTPException
-from app.schemas import TreeAnalysisRequest, AnalysisResponse, TreeAnalysisResult, TreeCharacteristic
-from app.utils import base64_to_image, image_to_base64, draw_detections
-from app.models.detection_model import TreeDetector
-from app.models.classification_model import TreeClassifier
-from app.models.health_analysis import HealthAnalyzer
+from fastapi import APIRouter, HTTPException, File, Query, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from app.schemas import (
+    TreeAnalysisRequest, AnalysisResponse, TreeAnalysisResult,
+    BatchAnalysisRequest, BatchAnalysisResponse, BatchItemResult, RenderMode, TiledAnalysisResponse,
+    SamplingMode, VideoAnalysisResponse
+)
+from app.config import settings
+from app.executor import AnalysisExecutor, ExecutorSaturated
+from app.batching import DeadlineExceeded, BatcherSaturated
+from app.models.roboflow_client import DetectorUnavailable
+from app.pipeline import (
+    detector, load_image, analyze_decoded,
+    crop_rois, analyze_tree, analyze_pixels, analyze_crops, render_decoded, warmup_image, warmup_pipeline
+)
+from app.utils import ImageTooLarge
+from app.rendering import RenderStore, RENDER_FORMATS, render_annotated
+from app.tiling import open_tile_source, detect_tiled, render_preview
+from app.tracking import IoUTracker
+from app.video import (
+    VideoDecodeError, ffmpeg_available, video_frames, sequence_frames, SceneSampler, encode_frame,
+    track_frames, track_summary
+)
+from app.serialization import dumps, compact_results, model_json, json_response
+from app.metrics import (
+    REGISTRY, Gauge, REQUEST_SECONDS, REQUESTS_IN_FLIGHT, ERRORS, STAGE_SECONDS,
+    record_timings, server_timing_header
+)
 from PIL import Image, ImageDraw
-import numpy as np
+import asyncio
+import os
+import tempfile
 import time
-import base64
 import io
+from typing import List
 
 router = APIRouter()
 
-# Инициализация моделей
-detector = TreeDetector()
-classifier = TreeClassifier()
-health_analyzer = HealthAnalyzer()
+# Пул для CPU-bound обработки изображений; сетевая детекция идет в event loop
+executor = AnalysisExecutor(
+    kind=settings.executor_kind,
+    max_workers=settings.executor_workers,
+    queue_size=settings.executor_queue_size,
+)
 
-# Инициализируем детектор при запуске
-@router.on_event("startup")
-async def startup_event():
-    """Инициализация моделей при запуске приложения"""
+# Хранилище для отложенной отрисовки изображений с разметкой
+render_store = RenderStore(
+    max_bytes=settings.render_store_max_bytes,
+    ttl_seconds=settings.render_ttl,
+    rendered_max_bytes=settings.render_cache_max_bytes,
+)
+
+# Глубина очередей снимается в момент выгрузки метрик
+REGISTRY.register(Gauge(
+    "tree_analysis_executor_pending", "Tasks submitted to the analysis pool and not yet finished",
+    callback=lambda: executor.pending
+))
+REGISTRY.register(Gauge(
+    "tree_detector_batch_queue_depth", "Detection requests waiting in the micro-batching queue",
+    callback=lambda: detector.batcher.queue_depth if detector.batcher is not None else 0
+))
+
+async def startup():
+    """
+    Инициализация моделей и прогрев; вызывается из lifespan приложения
+    в каждом процессе-воркере до того, как он начнет принимать запросы
+    """
     print("Initializing models...")
     success = detector.load_model()
     if success:
         print("TreeDetector initialized successfully")
     else:
         print("TreeDetector initialization failed - using stub mode")
+    executor.start()
+    print(f"Analysis executor started: {executor.kind} pool, {executor.max_workers} workers")
+    
+    await detector.warmup((warmup_image(), (640, 480)) if settings.detector_warmup_request else None)
+    # Прогрев пула: запуск процессов/потоков, импорт моделей и кодеков в каждом воркере
+    start_time = time.time()
+    await asyncio.gather(*(executor.run(warmup_pipeline) for _ in range(executor.max_workers)))
+    print(f"Warm-up finished: detector {detector.warmup_time}s, analysis pool {round(time.time() - start_time, 3)}s")
     print("All models initialized")
 
+async def shutdown():
+    executor.shutdown()
+    await detector.close()
+
 @router.get("/")
 async def analysis_root():
     return {"message": "Analysis router is working"}
 
 @router.post("/analyze", response_model=AnalysisResponse)
-async def analyze_image(request: TreeAnalysisRequest):
+async def analyze_image(request: TreeAnalysisRequest, render: RenderMode = RenderMode.inline,
+                        stream: bool = False, compact: bool = False):
+    return await _analyze(request.image_data, render, stream, compact)
+
+@router.post("/analyze/upload", response_model=AnalysisResponse)
+async def analyze_upload(file: UploadFile = File(...), render: RenderMode = RenderMode.inline,
+                         stream: bool = False, compact: bool = False):
+    """Анализ изображения, загруженного как multipart/form-data (без base64)"""
+    return await _analyze(await file.read(), render, stream, compact)
+
+@router.post("/analyze/raw", response_model=AnalysisResponse)
+async def analyze_raw(request: Request, render: RenderMode = RenderMode.inline,
+                      stream: bool = False, compact: bool = False):
+    """Анализ изображения, переданного в теле запроса как есть (image/jpeg, image/png, ...)"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.max_image_bytes:
+        raise HTTPException(status_code=413, detail=f"Image is too large: {content_length} bytes > {settings.max_image_bytes}")
+    image_bytes = await request.body()
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Empty request body")
+    return await _analyze(image_bytes, render, stream, compact)
+
+async def _analyze(image_data, render: RenderMode = RenderMode.inline, stream: bool = False,
+                   compact: bool = False) -> Response:
+    """
+    render=inline - изображение с разметкой в ответе, none - без изображения,
+    deferred - изображение рисуется по запросу через GET /api/v1/render/{render_id}.
+    stream=true - ответ в NDJSON по мере готовности (см. _stream_analysis).
+    compact=true - признаки состояния числами (1 - "да", 0 - "нет")
+    """
     start_time = time.time()
+    REQUESTS_IN_FLIGHT.inc()
     
     try:
-        # Конвертация base64 в изображение
-        pil_image = base64_to_image(request.image_data)
-        
-        # Конвертация PIL Image в numpy array (теперь не обязательна, но оставим для совместимости)
-        image_array = np.array(pil_image)
-        
-        # Детекция деревьев и кустарников
-        detections = detector.detect(image_array)
-        
-        results = []
-        for i, detection in enumerate(detections):
-            # Извлечение региона для анализа
-            x1, y1, x2, y2 = map(int, detection["bbox"])
-            # Обеспечиваем, чтобы координаты не выходили за границы
-            x1, y1 = max(0, x1), max(0, y1)
-            x2, y2 = min(pil_image.width, x2), min(pil_image.height, y2)
-            
-            if x2 > x1 and y2 > y1:
-                # Используем PIL для извлечения ROI
-                roi = pil_image.crop((x1, y1, x2, y2))
-                
-                # Классификация породы
-                species = classifier.predict_species(roi)
-                
-                # Анализ состояния
-                health_data = health_analyzer.analyze_health(roi, detection["class"])
-                
-                # Формирование результата
-                characteristics = TreeCharacteristic(
-                    species=species,
-                    trunk_rot=health_data.get("trunk_rot"),
-                    hollow=health_data.get("hollow"),
-                    trunk_crack=health_data.get("trunk_crack"),
-                    trunk_damage=health_data.get("trunk_damage"),
-                    crown_damage=health_data.get("crown_damage"),
-                    fruiting_bodies=health_data.get("fruiting_bodies"),
-                    dried_branches_percent=health_data.get("dried_branches_percent"),
-                    other_characteristics=health_data.get("other_characteristics")
-                )
-                
-                results.append(TreeAnalysisResult(
-                    tree_id=i+1,
-                    characteristics=characteristics,
-                    detection_confidence=detection["confidence"],
-                    object_type=detection["class"]
-                ))
-        
-        # Рисование bounding boxes на изображении (используем PIL вместо OpenCV)
-        processed_image = draw_detections_pil(pil_image, detections)
-        processed_image_base64 = image_to_base64(processed_image)
-        
-        processing_time = round(time.time() - start_time, 2)
-        
-        return AnalysisResponse(
-            results=results,
-            processed_image=processed_image_base64,
-            processing_time=processing_time,
-            objects_detected=len(detections)
-        )
-        
+        # Декодирование, кроп, отрисовка и кодирование выполняются в пуле,
+        # запрос к детектору - асинхронно; event loop остается свободным
+        decoded = await executor.run(load_image, image_data)
+        detect_start = time.perf_counter()
+        detections = await detector.detect(decoded.encoded, decoded.size, timeout=settings.detection_deadline)
+        detect_time = time.perf_counter() - detect_start
+        if stream:
+            return StreamingResponse(_stream_analysis(decoded, detections, render, start_time, compact),
+                                     media_type="application/x-ndjson")
+        analysis = await executor.run(analyze_decoded, decoded, detections, render == RenderMode.inline)
+    except Exception as e:
+        raise http_error(e)
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+    
+    # Этапы пула замеряются в воркере (возможно, в другом процессе) и переносятся сюда
+    timings = dict(decoded.timings, **analysis["timings"])
+    record_timings(timings)
+    
+    render_url = _deferred_render_url(decoded, detections) if render == RenderMode.deferred else None
+    
+    elapsed = time.time() - start_time
+    # Результаты конвейера валидируются один раз - здесь, дальше модель
+    # сразу сериализуется в bytes без повторного прохода по response_model
+    payload = AnalysisResponse(
+        results=analysis["results"],
+        processed_image=analysis["processed_image"],
+        render_url=render_url,
+        processing_time=round(elapsed, 2),
+        objects_detected=analysis["objects_detected"]
+    )
+    serialize_start = time.perf_counter()
+    content = model_json(payload, compact)
+    timings["serialize"] = time.perf_counter() - serialize_start
+    STAGE_SECONDS.observe(timings["serialize"], stage="serialize")
+    
+    elapsed = time.time() - start_time
+    REQUEST_SECONDS.observe(elapsed, endpoint="analyze")
+    headers = None
+    if settings.server_timing:
+        # detect - полное время ожидания детекции, включая очередь батчинга и кэш
+        timings["detect"] = detect_time
+        timings["total"] = elapsed
+        headers = {"Server-Timing": server_timing_header(timings)}
+    
+    return Response(content=content, media_type="application/json", headers=headers)
+
+def _deferred_render_url(decoded, detections: list) -> str:
+    # Отрисовка по запросу идет по исходному изображению, поэтому
+    # боксы переводятся в его координаты
+    render_id = render_store.put(decoded.source, decoded.to_original(detections))
+    return f"/api/v1/render/{render_id}"
+
+async def _stream_analysis(decoded, detections: list, render: RenderMode, start_time: float,
+                           compact: bool = False):
+    """
+    NDJSON-поток: сначала заголовок с детекциями (в координатах исходного
+    изображения), затем по строке на каждое
+    дерево сразу после его классификации и анализа состояния, последней -
+    итоговая запись (с изображением с разметкой при render=inline).
+    Ошибка после начала ответа передается записью {"type": "error"}.
+    """
+    REQUESTS_IN_FLIGHT.inc()
+    timings = dict(decoded.timings)
+    try:
+        header = {
+            "type": "header",
+            "objects_detected": len(detections),
+            # Боксы и размер - в координатах исходного изображения, как у render_url
+            "image_size": list(decoded.original_size),
+            "detections": decoded.to_original(detections),
+            "render_url": _deferred_render_url(decoded, detections) if render == RenderMode.deferred else None,
+        }
+        yield dumps(header) + b"\n"
+
+        # Кропы вырезаются одной задачей пула, а анализируются по одному,
+        # чтобы каждое дерево уходило клиенту сразу
+        rois = await executor.run(crop_rois, decoded.image, detections)
+        trees = 0
+        while rois:
+            # Отпускаем ссылку на кроп сразу после анализа
+            tree_id, roi = rois.pop(0)
+            tree = await executor.run(analyze_tree, roi, detections[tree_id - 1], tree_id)
+            _add_timings(timings, tree["timings"])
+            trees += 1
+            item = TreeAnalysisResult.model_validate(tree["result"]).model_dump()
+            if compact:
+                compact_results([item])
+            yield dumps(dict(item, type="tree")) + b"\n"
+
+        processed_image = None
+        if render == RenderMode.inline:
+            rendered = await executor.run(render_decoded, decoded, detections)
+            processed_image = rendered["processed_image"]
+            _add_timings(timings, rendered["timings"])
+
+        elapsed = time.time() - start_time
+        # Перевод строки отдельным куском, чтобы не копировать запись с изображением
+        yield dumps({
+            "type": "end",
+            "trees": trees,
+            "processing_time": round(elapsed, 2),
+            "processed_image": processed_image,
+        })
+        yield b"\n"
+        record_timings(timings)
+        REQUEST_SECONDS.observe(elapsed, endpoint="analyze_stream")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
-
-def draw_detections_pil(pil_image: Image.Image, detections: list) -> Image.Image:
-    """Рисует bounding boxes на изображении с использованием PIL"""
-    # Создаем копию изображения чтобы не изменять оригинал
-    image_copy = pil_image.copy()
-    draw = ImageDraw.Draw(image_copy)
-    
-    for detection in detections:
-        x1, y1, x2, y2 = detection["bbox"]
-        class_name = detection["class"]
-        confidence = detection["confidence"]
-        
-        # Выбираем цвет в зависимости от класса
-        color = "green" if class_name == "tree" else "blue"
-        
-        # Рисуем bounding box
-        draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
-        
-        # Рисуем метку
-        label = f"{class_name} {confidence:.2f}"
-        # Рисуем фон для текста
-        text_bbox = draw.textbbox((x1, y1 - 20), label)
-        draw.rectangle(text_bbox, fill=color)
-        draw.text((x1, y1 - 20), label, fill="white")
-    
-    return image_copy
+        ERRORS.inc(type=error_type(e))
+        yield dumps({"type": "error", "detail": describe_error(e)}) + b"\n"
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+
+def _add_timings(total: dict, timings: dict):
+    for stage, seconds in timings.items():
+        total[stage] = total.get(stage, 0.0) + seconds
+
+@router.post("/analyze/tiled", response_model=TiledAnalysisResponse)
+async def analyze_tiled(
+    request: Request,
+    render: RenderMode = RenderMode.none,
+    tile_size: int = Query(settings.tile_size, ge=256, le=8192),
+    overlap: int = Query(settings.tile_overlap, ge=0),
+    compact: bool = False,
+):
+    """
+    Потайловый анализ больших снимков (ортофото, панорамы); файл передается
+    в теле запроса как есть. Детекция идет по перекрывающимся тайлам в полном
+    разрешении, боксы объединяются в координатах всего изображения.
+    Несжатые TIFF/PPM/BMP и .npy читаются через memmap без загрузки в память.
+    render=inline - уменьшенное превью с разметкой; deferred не поддерживается.
+    """
+    if render == RenderMode.deferred:
+        raise HTTPException(status_code=400, detail="render=deferred is not supported for tiled analysis")
+    if overlap >= tile_size:
+        raise HTTPException(status_code=400, detail="overlap must be smaller than tile_size")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.tile_max_upload_bytes:
+        raise HTTPException(status_code=413, detail=f"Image is too large: {content_length} bytes > {settings.tile_max_upload_bytes}")
+    
+    start_time = time.time()
+    REQUESTS_IN_FLIGHT.inc()
+    path = None
+    try:
+        path = await _save_upload(request, settings.tile_max_upload_bytes)
+        if os.path.getsize(path) == 0:
+            raise HTTPException(status_code=400, detail="Empty request body")
+        source = await asyncio.to_thread(open_tile_source, path, settings.tile_max_pixels, settings.max_image_pixels)
+        with STAGE_SECONDS.time(stage="tiled_detection"):
+            detections, tiles = await detect_tiled(
+                source, detector, tile_size, overlap,
+                batch_size=settings.tile_batch_size,
+                concurrency=settings.tile_concurrency,
+                iou_threshold=settings.detection_iou_threshold,
+            )
+        # Источник может быть memmap - анализ и превью в потоках, а не в пуле процессов
+        results = await asyncio.to_thread(analyze_pixels, source.pixels, detections)
+        processed_image = None
+        if render == RenderMode.inline:
+            processed_image = await asyncio.to_thread(render_preview, source, detections, settings.tile_preview_size)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise http_error(e)
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        if path is not None:
+            os.unlink(path)
+    
+    width, height = source.size
+    elapsed = time.time() - start_time
+    REQUEST_SECONDS.observe(elapsed, endpoint="tiled")
+    
+    return json_response(TiledAnalysisResponse(
+        # Без разметки на изображении расположение объекта дает только бокс
+        results=[dict(result, bbox=detections[result["tree_id"] - 1]["bbox"]) for result in results],
+        processed_image=processed_image,
+        processing_time=round(elapsed, 2),
+        image_width=width,
+        image_height=height,
+        tiles=tiles,
+        objects_detected=len(detections)
+    ), compact)
+
+async def _save_upload(request: Request, max_bytes: int) -> str:
+    """Сохраняет тело запроса во временный файл по частям, не держа его в памяти"""
+    fd, path = tempfile.mkstemp(prefix="tiled_", dir=settings.tile_temp_dir)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLarge(f"Image is too large: more than {max_bytes} bytes")
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+@router.post("/analyze/video", response_model=VideoAnalysisResponse)
+async def analyze_video(
+    request: Request,
+    fps: float = Query(settings.video_sample_fps, gt=0, le=60),
+    sampling: SamplingMode = SamplingMode.rate,
+    scene_threshold: float = Query(settings.video_scene_threshold, ge=0, le=1),
+    compact: bool = False,
+):
+    """
+    Анализ видео (файл в теле запроса как есть, любой формат, который читает
+    ffmpeg). Кадры декодируются потоком с частотой fps; при sampling=scene
+    почти не изменившиеся кадры (стоянка, медленное движение) пропускаются.
+    Детекции связываются между кадрами IoU-трекером, и каждый объект
+    классифицируется и анализируется один раз - по кадру, где детектор
+    уверен в нем больше всего.
+    """
+    if not ffmpeg_available(settings.ffmpeg_path):
+        raise HTTPException(status_code=501, detail="Video decoding is not available: ffmpeg not found")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.video_max_upload_bytes:
+        raise HTTPException(status_code=413, detail=f"Video is too large: {content_length} bytes > {settings.video_max_upload_bytes}")
+    
+    start_time = time.time()
+    REQUESTS_IN_FLIGHT.inc()
+    path = None
+    try:
+        path = await _save_upload(request, settings.video_max_upload_bytes)
+        if os.path.getsize(path) == 0:
+            raise HTTPException(status_code=400, detail="Empty request body")
+        frames = video_frames(path, settings.ffmpeg_path, fps, settings.detector_input_size,
+                              settings.video_max_frames)
+        return await _analyze_frames(frames, sampling, scene_threshold, compact, start_time, "video")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise http_error(e)
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        if path is not None:
+            os.unlink(path)
+
+@router.post("/analyze/sequence", response_model=VideoAnalysisResponse)
+async def analyze_sequence(
+    files: List[UploadFile] = File(...),
+    frame_rate: float = Query(1.0, gt=0),
+    sampling: SamplingMode = SamplingMode.rate,
+    scene_threshold: float = Query(settings.video_scene_threshold, ge=0, le=1),
+    compact: bool = False,
+):
+    """
+    То же для последовательности кадров-изображений (multipart/form-data,
+    в порядке съемки); frame_rate - частота съемки для времени кадров
+    """
+    if len(files) > settings.video_max_frames:
+        raise HTTPException(status_code=413, detail=f"Too many frames: {len(files)} > {settings.video_max_frames}")
+    
+    start_time = time.time()
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        frames = sequence_frames(files, frame_rate, settings.detector_input_size,
+                                 settings.max_image_bytes, settings.max_image_pixels)
+        return await _analyze_frames(frames, sampling, scene_threshold, compact, start_time, "sequence")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise http_error(e)
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+
+async def _analyze_frames(frames, sampling: SamplingMode, scene_threshold: float, compact: bool,
+                          start_time: float, endpoint: str) -> Response:
+    tracker = IoUTracker(settings.track_iou_threshold, settings.track_max_age, settings.track_min_hits)
+    sampler = SceneSampler(scene_threshold if sampling == SamplingMode.scene else 0.0)
+    
+    async def detect(pixels):
+        encoded = await executor.run(encode_frame, pixels)
+        return await detector.detect(encoded, (pixels.shape[1], pixels.shape[0]),
+                                     timeout=settings.detection_deadline)
+    
+    with STAGE_SECONDS.time(stage="frame_detection"):
+        stats = await track_frames(frames, detect, tracker, sampler,
+                                   settings.video_concurrency, settings.video_snapshot_size)
+    if not stats["frames_analyzed"]:
+        raise HTTPException(status_code=400, detail="No frames decoded")
+    
+    # Короткая последовательность не может подтвердить трек min_hits кадрами
+    tracker.min_hits = min(tracker.min_hits, stats["frames_analyzed"])
+    tracks = [track for track in tracker.close() if track.snapshot is not None]
+    # Классификация и анализ состояния - один раз на трек, одним батчем
+    analysis = await executor.run(analyze_crops, [track.snapshot for track in tracks],
+                                  [track.best_detection for track in tracks])
+    record_timings(analysis["timings"])
+    
+    elapsed = time.time() - start_time
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    
+    frame_width, frame_height = stats["frame_size"]
+    return json_response(VideoAnalysisResponse(
+        results=[dict(result, **track_summary(track)) for track, result in zip(tracks, analysis["results"])],
+        frame_width=frame_width,
+        frame_height=frame_height,
+        frames_read=stats["frames_read"],
+        frames_analyzed=stats["frames_analyzed"],
+        detections=stats["detections"],
+        tracks=len(tracks),
+        processing_time=round(elapsed, 2)
+    ), compact)
+
+@router.get("/render/{render_id}")
+async def get_rendered_image(
+    render_id: str,
+    format: str = Query("jpeg", pattern="^(jpeg|webp)$"),
+    quality: int = Query(settings.render_quality, ge=1, le=100),
+    max_dim: int = Query(settings.render_max_dim, ge=0),
+):
+    """Изображение с разметкой для анализа, выполненного с render=deferred"""
+    _, media_type = RENDER_FORMATS[format]
+    cache_key = (render_id, format, quality, max_dim)
+    
+    content = render_store.get_rendered(cache_key)
+    if content is None:
+        source = render_store.get_source(render_id)
+        if source is None:
+            raise HTTPException(status_code=404, detail="Rendered image not found or expired")
+        image_bytes, detections = source
+        try:
+            with STAGE_SECONDS.time(stage="deferred_render"):
+                content = await executor.run(render_annotated, image_bytes, detections, format, quality, max_dim,
+                                             settings.max_image_pixels)
+        except Exception as e:
+            raise http_error(e)
+        render_store.put_rendered(cache_key, content)
+    
+    return Response(content=content, media_type=media_type)
+
+@router.post("/analyze/batch", response_model=BatchAnalysisResponse)
+async def analyze_batch(request: BatchAnalysisRequest, compact: bool = False):
+    """
+    Пакетный анализ: детекция для всех изображений выполняется параллельно
+    (не более BATCH_CONCURRENCY одновременно), анализ ROI каждого изображения -
+    отдельной задачей пула сразу после его детекции.
+    Ошибка в одном изображении (в том числе переполнение пула) не прерывает
+    обработку остальных и возвращается в его элементе ответа.
+    """
+    start_time = time.time()
+    
+    if len(request.images) > settings.batch_max_images:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images in batch: {len(request.images)} > {settings.batch_max_images}"
+        )
+    
+    semaphore = asyncio.Semaphore(settings.batch_concurrency)
+    
+    async def analyze_one(image_data: str) -> dict:
+        async with semaphore:
+            decoded = await executor.run(load_image, image_data)
+            detections = await detector.detect(decoded.encoded, decoded.size, timeout=settings.detection_deadline)
+        record_timings(decoded.timings)
+        return await executor.run(analyze_decoded, decoded, detections, request.include_images)
+    
+    analyses = await asyncio.gather(
+        *(analyze_one(image_data) for image_data in request.images),
+        return_exceptions=True
+    )
+    
+    items = []
+    for i, analysis in enumerate(analyses):
+        if isinstance(analysis, BaseException):
+            ERRORS.inc(type=error_type(analysis))
+            items.append(BatchItemResult(index=i, success=False, error=describe_error(analysis)))
+            continue
+        items.append(BatchItemResult(
+            index=i,
+            success=True,
+            results=analysis["results"],
+            processed_image=analysis["processed_image"],
+            objects_detected=analysis["objects_detected"]
+        ))
+        record_timings(analysis["timings"])
+    
+    failed = sum(1 for item in items if not item.success)
+    
+    elapsed = time.time() - start_time
+    REQUEST_SECONDS.observe(elapsed, endpoint="batch")
+    
+    return json_response(BatchAnalysisResponse(
+        items=items,
+        processing_time=round(elapsed, 2),
+        images_processed=len(items) - failed,
+        images_failed=failed
+    ), compact)
+
+def error_type(error: BaseException) -> str:
+    """Метка ошибки для счетчика tree_analysis_errors_total"""
+    if isinstance(error, ImageTooLarge):
+        return "image_too_large"
+    if isinstance(error, (ExecutorSaturated, BatcherSaturated)):
+        return "busy"
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    if isinstance(error, DetectorUnavailable):
+        return "detector_unavailable"
+    return "internal"
+
+def error_status(error: BaseException) -> int:
+    """HTTP-статус ответа для ошибки анализа"""
+    if isinstance(error, ImageTooLarge):
+        return 413
+    if isinstance(error, VideoDecodeError):
+        return 415
+    if isinstance(error, (ExecutorSaturated, BatcherSaturated, DetectorUnavailable)):
+        return 503
+    if isinstance(error, DeadlineExceeded):
+        return 504
+    return 500
+
+def http_error(error: BaseException) -> HTTPException:
+    """Ошибка анализа как HTTP-ответ (с учетом в tree_analysis_errors_total)"""
+    ERRORS.inc(type=error_type(error))
+    return HTTPException(status_code=error_status(error), detail=describe_error(error))
+
+def describe_error(error: BaseException) -> str:
+    if isinstance(error, (ImageTooLarge, VideoDecodeError)):
+        return str(error)
+    if isinstance(error, (ExecutorSaturated, BatcherSaturated)):
+        return f"Server is busy: {str(error)}"
+    if isinstance(error, DeadlineExceeded):
+        return f"Detection timed out: {str(error)}"
+    if isinstance(error, DetectorUnavailable):
+        return f"Detector unavailable: {str(error)}"
+    return f"Error processing image: {str(error)}"
 
 @router.get("/test")
 async def test_endpoint():
@@ -136,12 +566,21 @@ async def test_endpoint():
         "endpoints": {
             "health": "/api/v1/health",
             "analyze": "/api/v1/analyze (POST)",
+            "analyze_batch": "/api/v1/analyze/batch (POST)",
+            "analyze_upload": "/api/v1/analyze/upload (POST, multipart/form-data)",
+            "analyze_raw": "/api/v1/analyze/raw (POST, binary body)",
+            "analyze_tiled": "/api/v1/analyze/tiled (POST, binary body, large images)",
+            "analyze_video": "/api/v1/analyze/video (POST, binary body, video file)",
+            "analyze_sequence": "/api/v1/analyze/sequence (POST, multipart/form-data, frames)",
+            "render": "/api/v1/render/{render_id} (GET)",
+            "jobs": "/api/v1/jobs (POST), /api/v1/jobs/{job_id} (GET, DELETE)",
+            "job_results": "/api/v1/jobs/{job_id}/results, /api/v1/jobs/{job_id}/stream (GET)",
             "test": "/api/v1/test"
         }
     }
 
 @router.get("/demo")
-async def demo_analysis():
+async def demo_analysis(render: RenderMode = RenderMode.inline, compact: bool = False):
     """Демо-эндпоинт для тестирования без отправки изображения"""
     # Создаем тестовое изображение
     test_image = Image.new('RGB', (800, 600), color='lightblue')
@@ -154,16 +593,12 @@ async def demo_analysis():
     draw.rectangle([400, 150, 450, 350], fill='brown', outline='black', width=2)
     draw.ellipse([350, 100, 500, 250], fill='green', outline='darkgreen', width=2)
     
-    # Конвертируем в base64
+    # Кодируем в JPEG
     buffered = io.BytesIO()
     test_image.save(buffered, format="JPEG")
-    image_base64 = base64.b64encode(buffered.getvalue()).decode()
-    
-    # Создаем запрос
-    request = TreeAnalysisRequest(image_data=image_base64)
     
     # Вызываем анализ
-    return await analyze_image(request)
+    return await _analyze(buffered.getvalue(), render, compact=compact)
 
 @router.get("/model-status")
 async def model_status():
@@ -171,5 +606,9 @@ async def model_status():
     return {
         "detector_loaded": detector.is_loaded,
         "detector_model_id": detector.model_id,
-        "message": "Model is using Roboflow inference API" if detector.is_loaded else "Model is using stub implementation"
+        "detector": detector.status(),
+        "executor": executor.status(),
+        "detection_cache": detector.cache.stats() if detector.cache is not None else None,
+        "render_store": render_store.stats(),
+        "message": f"Model is using {detector.backend.name} backend" if detector.is_loaded else "Model is using stub implementation"
     }
@@ -1,12 +1,49 @@
 
+import os
+
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.config import settings
+from app.pipeline import detector
 
 router = APIRouter()
 
+# Состояние процесса для проб оркестратора; выставляется lifespan-обработчиком (app.main)
+service_state = {"ready": False, "startup_time": None}
+
 @router.get("/health")
 async def health_check():
     return {"status": "healthy", "message": "Tree analysis server is running"}
 
+@router.get("/health/live")
+async def liveness():
+    """Liveness: процесс жив и event loop отвечает; модели не проверяются"""
+    return {"status": "alive", "pid": os.getpid()}
+
+@router.get("/health/ready")
+async def readiness():
+    """
+    Readiness: прогрев завершен и детектор работает в настроенном режиме.
+    Переход на заглушку из-за ошибки инициализации - не готов (503).
+    """
+    reasons = []
+    if not service_state["ready"]:
+        reasons.append("startup is not finished or the worker is shutting down")
+    elif not detector.is_loaded and settings.detector_backend != "stub":
+        reasons.append(f"detector backend '{settings.detector_backend}' failed to load, stub is used")
+
+    body = {
+        "status": "not_ready" if reasons else "ready",
+        "reasons": reasons,
+        "pid": os.getpid(),
+        "detector_backend": detector.backend.name if detector.backend is not None else None,
+        "detector_load_time": detector.load_time,
+        "detector_warmup_time": detector.warmup_time,
+        "startup_time": service_state["startup_time"],
+    }
+    return JSONResponse(status_code=503 if reasons else 200, content=body)
+
 @router.get("/")
 async def root():
     return {"message": "Health router is working"}
@@ -0,0 +1,180 @@
+
+from typing import List, Optional
+
+from fastapi import APIRouter, File, Header, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+
+from app.schemas import JobSubmitRequest, JobSubmitResponse, JobStatus, JobResultItem, JobResultsResponse
+from app.config import settings
+from app.executor import ExecutorSaturated
+from app.batching import BatcherSaturated
+from app.jobs import JobManager, JobQueueFull, FINISHED_STATUSES, create_job_store
+from app.metrics import REGISTRY, Gauge, ERRORS, record_timings
+from app.pipeline import detector, load_image, analyze_decoded
+from app.routers.analysis import executor, describe_error, error_type
+from app.serialization import dumps, compact_results, json_response
+
+router = APIRouter()
+
+# Как часто стрим перечитывает хранилище, если в этом процессе ничего не произошло
+# (задача могла быть создана другим процессом-воркером с общим SQLite-хранилищем)
+STREAM_POLL_INTERVAL = 1.0
+
+
+async def _process_job_image(image_data) -> dict:
+    """Тот же конвейер, что и у /analyze, без отрисовки изображения"""
+    try:
+        decoded = await executor.run(load_image, image_data)
+        detections = await detector.detect(decoded.encoded, decoded.size, timeout=settings.detection_deadline)
+        analysis = await executor.run(analyze_decoded, decoded, detections, False)
+    except (ExecutorSaturated, BatcherSaturated):
+        # Повторяется менеджером задач
+        raise
+    except Exception as e:
+        ERRORS.inc(type=error_type(e))
+        return {"success": False, "error": describe_error(e)}
+
+    record_timings(dict(decoded.timings, **analysis["timings"]))
+    return {"success": True, "results": analysis["results"], "objects_detected": analysis["objects_detected"]}
+
+
+job_manager = JobManager(
+    store=create_job_store(settings.job_store, settings.job_store_path),
+    process_image=_process_job_image,
+    num_workers=settings.job_workers,
+    max_pending=settings.job_max_pending,
+    ttl_seconds=settings.job_ttl,
+    retry_on=(ExecutorSaturated, BatcherSaturated),
+    heartbeat_interval=settings.job_heartbeat_interval,
+)
+
+REGISTRY.register(Gauge(
+    "tree_job_pending_images", "Images of background jobs waiting to be analyzed",
+    callback=lambda: job_manager.pending
+))
+
+async def startup():
+    job_manager.start()
+    print(f"Job manager started: {job_manager.num_workers} workers, {type(job_manager.store).__name__}")
+
+async def shutdown():
+    await job_manager.stop()
+
+@router.post("/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_job(request: JobSubmitRequest):
+    """Создает фоновую задачу анализа; результаты забираются опросом или стримом"""
+    return await _submit(request.images)
+
+@router.post("/jobs/upload", response_model=JobSubmitResponse, status_code=202)
+async def submit_job_upload(files: List[UploadFile] = File(...)):
+    """Создает фоновую задачу из файлов multipart/form-data (без base64)"""
+    _check_job_size(len(files))
+    return await _submit([await file.read() for file in files])
+
+def _check_job_size(count: int):
+    if count == 0:
+        raise HTTPException(status_code=400, detail="Job has no images")
+    if count > settings.job_max_images:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images in job: {count} > {settings.job_max_images}"
+        )
+
+async def _submit(images: list) -> JobSubmitResponse:
+    _check_job_size(len(images))
+    try:
+        job = await job_manager.submit(images)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Server is busy: {str(e)}")
+
+    base_url = f"/api/v1/jobs/{job['job_id']}"
+    return JobSubmitResponse(
+        **job,
+        status_url=base_url,
+        results_url=f"{base_url}/results",
+        stream_url=f"{base_url}/stream",
+    )
+
+async def _get_job(job_id: str) -> dict:
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """Статус и прогресс задачи"""
+    return JobStatus(**await _get_job(job_id))
+
+@router.get("/jobs/{job_id}/results", response_model=JobResultsResponse)
+async def get_job_results(job_id: str, after: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000),
+                          compact: bool = False):
+    """
+    Результаты с номером seq > after; для следующей порции передайте next_after.
+    compact=true - признаки состояния числами (1 - "да", 0 - "нет")
+    """
+    job = await _get_job(job_id)
+    records = await job_manager.results(job_id, after=after, limit=limit)
+    return json_response(JobResultsResponse(
+        job=JobStatus(**job),
+        items=[JobResultItem(**record) for record in records],
+        next_after=records[-1]["seq"] if records else after,
+    ), compact)
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job_results(
+    job_id: str,
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    after: int = Query(0, ge=0),
+    last_event_id: Optional[str] = Header(None),
+    compact: bool = False,
+):
+    """
+    Результаты по мере готовности: NDJSON (по строке на изображение, последняя
+    строка - итоговый статус задачи) или Server-Sent Events. SSE-клиент после
+    переподключения продолжает с Last-Event-ID.
+    compact=true - признаки состояния числами (1 - "да", 0 - "нет")
+    """
+    await _get_job(job_id)
+    if last_event_id and last_event_id.isdigit():
+        after = max(after, int(last_event_id))
+
+    if format == "sse":
+        return StreamingResponse(_stream_records(job_id, after, sse=True, compact=compact),
+                                 media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    return StreamingResponse(_stream_records(job_id, after, sse=False, compact=compact),
+                             media_type="application/x-ndjson")
+
+async def _stream_records(job_id: str, after: int, sse: bool, compact: bool = False):
+    while True:
+        # Статус читаем до результатов: если задача уже завершена,
+        # все ее результаты попадут в эту же выборку
+        job = await job_manager.get(job_id)
+        for record in await job_manager.results(job_id, after=after):
+            after = record["seq"]
+            item = JobResultItem(**record).model_dump()
+            if compact:
+                compact_results(item["results"])
+            if sse:
+                yield f"id: {after}\nevent: result\ndata: ".encode() + dumps(item) + b"\n\n"
+            else:
+                yield dumps(dict(item, type="result")) + b"\n"
+
+        if job is None or job["status"] in FINISHED_STATUSES:
+            break
+        await job_manager.wait_for_update(job_id, STREAM_POLL_INTERVAL)
+
+    summary = JobStatus(**job).model_dump() if job is not None else {"job_id": job_id, "status": "expired"}
+    if sse:
+        yield b"event: end\ndata: " + dumps(summary) + b"\n\n"
+    else:
+        yield dumps(dict(summary, type="job")) + b"\n"
+
+@router.delete("/jobs/{job_id}", response_model=JobStatus)
+async def cancel_job(job_id: str):
+    """Отмена задачи: необработанные изображения пропускаются, готовые результаты остаются"""
+    await _get_job(job_id)
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return JobStatus(**job)
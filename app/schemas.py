@@ -1,6 +1,12 @@
+from enum import Enum
 from pydantic import BaseModel
 from typing import List, Optional
 
+class RenderMode(str, Enum):
+    inline = "inline"      # изображение с разметкой в ответе (base64)
+    none = "none"          # только структурированные результаты
+    deferred = "deferred"  # ссылка на GET /api/v1/render/{render_id}
+
 class TreeAnalysisRequest(BaseModel):
     image_data: str  # base64 encoded image
 
@@ -18,8 +24,94 @@ class TreeCharacteristic(BaseModel):
 class TreeAnalysisResult(BaseModel):
     tree_id: int
     characteristics: TreeCharacteristic
+    detection_confidence: Optional[float] = None  # уверенность детектора
+    object_type: Optional[str] = None  # класс объекта детектора
 
 class AnalysisResponse(BaseModel):
     results: List[TreeAnalysisResult]
-    processed_image: str  # base64 encoded image with annotations
+    processed_image: Optional[str] = None  # base64 encoded image with annotations (render=inline)
+    render_url: Optional[str] = None  # ссылка на изображение с разметкой (render=deferred)
+    processing_time: float
+    objects_detected: int = 0
+
+class TiledTreeResult(TreeAnalysisResult):
+    bbox: List[int]  # бокс в координатах всего изображения
+
+class TiledAnalysisResponse(AnalysisResponse):
+    results: List[TiledTreeResult]
+    image_width: int
+    image_height: int
+    tiles: int  # число тайлов, отправленных детектору
+
+class SamplingMode(str, Enum):
+    rate = "rate"    # все кадры после прореживания до fps
+    scene = "scene"  # только кадры, заметно отличающиеся от предыдущего отобранного
+
+class TrackAnalysisResult(TreeAnalysisResult):
+    track_id: int
+    frames: int  # число отобранных кадров, на которых объект обнаружен
+    first_frame: int  # номера кадров после прореживания до fps
+    last_frame: int
+    first_time: float  # секунды от начала видео
+    last_time: float
+    best_frame: int  # кадр с максимальной уверенностью, по которому выполнен анализ
+    bbox: List[int]  # бокс на лучшем кадре в координатах кадра
+
+class VideoAnalysisResponse(BaseModel):
+    results: List[TrackAnalysisResult]  # по одному результату на трек (физический объект)
+    frame_width: int
+    frame_height: int
+    frames_read: int  # кадров получено от декодера
+    frames_analyzed: int  # кадров отправлено детектору
+    detections: int  # детекций на всех кадрах
+    tracks: int
+    processing_time: float
+
+class BatchAnalysisRequest(BaseModel):
+    images: List[str]  # base64 encoded images
+    include_images: bool = False  # возвращать ли изображения с разметкой
+
+class BatchItemResult(BaseModel):
+    index: int  # позиция изображения в запросе
+    success: bool
+    error: Optional[str] = None
+    results: List[TreeAnalysisResult] = []
+    processed_image: Optional[str] = None
+    objects_detected: int = 0
+
+class BatchAnalysisResponse(BaseModel):
+    items: List[BatchItemResult]
     processing_time: float
+    images_processed: int
+    images_failed: int
+
+class JobSubmitRequest(BaseModel):
+    images: List[str]  # base64 encoded images
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str  # queued, running, completed, cancelled, interrupted
+    total: int
+    completed: int
+    failed: int
+    progress: float  # доля обработанных изображений (0..1)
+    created_at: float
+    updated_at: float
+
+class JobSubmitResponse(JobStatus):
+    status_url: str
+    results_url: str
+    stream_url: str
+
+class JobResultItem(BaseModel):
+    seq: int  # порядковый номер результата в задаче (по времени завершения)
+    index: int  # позиция изображения в задаче
+    success: bool
+    error: Optional[str] = None
+    results: List[TreeAnalysisResult] = []
+    objects_detected: int = 0
+
+class JobResultsResponse(BaseModel):
+    job: JobStatus
+    items: List[JobResultItem]
+    next_after: int  # значение after для следующего запроса
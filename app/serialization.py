@@ -0,0 +1,62 @@
+
+import json
+
+from fastapi import Response
+from pydantic import BaseModel
+
+from app.models.health_analysis import HEALTH_FLAGS
+
+try:
+    import orjson
+except ImportError:  # без orjson модели сериализует pydantic-core, остальное - json
+    orjson = None
+
+# Компактный формат: признаки состояния числами вместо строк
+FLAG_CODES = {"нет": 0, "да": 1}
+FLAG_FIELDS = tuple(name for name, _ in HEALTH_FLAGS)
+
+
+def dumps(obj) -> bytes:
+    """JSON сразу в bytes (UTF-8, без экранирования кириллицы)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode()
+
+
+def compact_results(results: list) -> list:
+    """Заменяет "да"/"нет" в характеристиках деревьев на 1/0 (на месте)"""
+    for item in results:
+        characteristics = item["characteristics"]
+        for name in FLAG_FIELDS:
+            value = characteristics.get(name)
+            if value is not None:
+                characteristics[name] = FLAG_CODES.get(value, value)
+    return results
+
+
+def _compact(data: dict):
+    compact_results(data.get("results", ()))
+    for item in data.get("items", ()):
+        _compact(item)
+
+
+def model_json(model: BaseModel, compact: bool = False) -> bytes:
+    """
+    Сериализация уже провалидированной модели ответа в bytes. Строки
+    (в том числе base64-изображение) копируются один раз - сразу в результат.
+    """
+    if orjson is None and not compact:
+        return model.__pydantic_serializer__.to_json(model)
+    data = model.model_dump()
+    if compact:
+        _compact(data)
+    return dumps(data)
+
+
+def json_response(model: BaseModel, compact: bool = False, headers: dict = None) -> Response:
+    """
+    Готовый JSON-ответ. Эндпоинт возвращает Response, поэтому FastAPI не
+    валидирует и не кодирует результат повторно по response_model
+    (response_model остается для схемы OpenAPI).
+    """
+    return Response(content=model_json(model, compact), media_type="application/json", headers=headers)
@@ -0,0 +1,39 @@
+import os
+import sqlite3
+from typing import Callable, Optional
+
+
+class ProcessSQLite:
+    """
+    SQLite-соединение текущего процесса для хранилищ, общих для воркеров
+    gunicorn (кэш детекций, задачи, лимиты допуска). Соединение нельзя
+    разделять между процессами, поэтому после fork оно открывается заново;
+    setup(db) создает таблицы при каждом открытии.
+
+    Соединение в режиме autocommit (транзакции - явные BEGIN) и WAL.
+    Блокировки между потоками - забота хранилища.
+    """
+
+    def __init__(self, path: str, setup: Optional[Callable[[sqlite3.Connection], None]] = None,
+                 timeout: float = 5.0, row_factory=None, synchronous: Optional[str] = None):
+        self.path = path
+        self.setup = setup
+        self.timeout = timeout
+        self.row_factory = row_factory
+        self.synchronous = synchronous
+        self._db = None
+        self._pid = None
+
+    def get(self) -> sqlite3.Connection:
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=self.timeout)
+            if self.row_factory is not None:
+                db.row_factory = self.row_factory
+            db.execute("PRAGMA journal_mode=WAL")
+            if self.synchronous:
+                db.execute(f"PRAGMA synchronous={self.synchronous}")
+            if self.setup is not None:
+                self.setup(db)
+            self._db = db
+            self._pid = os.getpid()
+        return self._db
@@ -0,0 +1,258 @@
+
+import asyncio
+import io
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from app.models.postprocessing import class_aware_nms
+from app.utils import ImageTooLarge, exif_orientation, apply_orientation, draw_detections_pil, image_to_base64
+
+NPY_MAGIC = b"\x93NUMPY"
+
+class TileSource:
+    """
+    Изображение для потайловой обработки: массив (H, W, 3) uint8.
+    Для memmap-источников пиксели читаются с диска только для запрошенных
+    окон, поэтому большое изображение целиком в памяти не находится.
+    """
+
+    def __init__(self, pixels, kind: str):
+        self.pixels = pixels
+        self.kind = kind
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        height, width = self.pixels.shape[:2]
+        return width, height
+
+    def read(self, window: tuple) -> np.ndarray:
+        x0, y0, x1, y1 = window
+        return np.ascontiguousarray(self.pixels[y0:y1, x0:x1])
+
+    def preview(self, max_side: int) -> Image.Image:
+        """Уменьшенная копия (прореживание строк и столбцов) без чтения лишних строк"""
+        width, height = self.size
+        step = max(1, -(-max(width, height) // max_side))
+        return Image.fromarray(np.ascontiguousarray(self.pixels[::step, ::step]))
+
+
+def _raw_layout(image: Image.Image) -> Optional[tuple]:
+    """
+    (offset, stride, rawmode, orientation), если пиксели лежат в файле несжатыми
+    одним непрерывным блоком (несжатый TIFF, PPM, BMP), иначе None
+    """
+    if image.mode != "RGB" or not image.tile:
+        return None
+    width, height = image.size
+    first = image.tile[0]
+    layout = None
+    for tile in image.tile:
+        codec, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+        if codec != "raw":
+            return None
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if rawmode not in ("RGB", "BGR") or extents[0] != 0 or extents[2] != width:
+            return None
+        stride = stride or width * 3
+        # Полосы (strips) должны идти подряд, как одна картинка
+        expected = first[2] + extents[1] * stride
+        if offset != expected or (layout is not None and layout[1:] != (stride, rawmode, orientation)):
+            return None
+        layout = (first[2], stride, rawmode, orientation)
+    return layout
+
+
+def open_tile_source(path: str, max_pixels: int = 0, max_decoded_pixels: int = 0) -> TileSource:
+    """
+    Открывает файл для потайловой детекции:
+    .npy (H, W, 3) uint8 и несжатые RGB-растры (TIFF, PPM, BMP) отображаются
+    в память (np.memmap) без декодирования; остальные форматы декодируются
+    целиком через PIL, поэтому для них действует более строгий max_decoded_pixels.
+    """
+    with open(path, "rb") as f:
+        is_npy = f.read(len(NPY_MAGIC)) == NPY_MAGIC
+    if is_npy:
+        pixels = np.load(path, mmap_mode="r")
+        if pixels.ndim != 3 or pixels.shape[2] != 3 or pixels.dtype != np.uint8:
+            raise ValueError(f"Expected (H, W, 3) uint8 array, got {pixels.shape} {pixels.dtype}")
+        _check_pixels(pixels.shape[1], pixels.shape[0], max_pixels)
+        return TileSource(pixels, "memmap")
+
+    try:
+        # Лимит PIL задан при старте (configure_pil_limit) не ниже TILE_MAX_PIXELS
+        image = Image.open(path)
+    except UnidentifiedImageError:
+        raise ValueError("Unsupported image format")
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    with image:
+        width, height = image.size
+        _check_pixels(width, height, max_pixels)
+        layout = _raw_layout(image) if exif_orientation(image) == 1 else None
+        if layout is not None:
+            offset, stride, rawmode, orientation = layout
+            rows = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(height, stride))
+            # Все преобразования - представления: строки снизу вверх (BMP), порядок каналов BGR
+            pixels = rows[::orientation, :width * 3].reshape(height, width, 3)
+            if rawmode == "BGR":
+                pixels = pixels[..., ::-1]
+            return TileSource(pixels, "memmap")
+
+        _check_pixels(width, height, max_decoded_pixels)
+        orientation = exif_orientation(image)
+        decoded = apply_orientation(image.convert("RGB"), orientation)
+        return TileSource(np.asarray(decoded), "decoded")
+
+
+def _check_pixels(width: int, height: int, max_pixels: int):
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Image is too large: {width}x{height} pixels > {max_pixels}")
+
+
+def tile_windows(width: int, height: int, tile_size: int, overlap: int) -> List[tuple]:
+    """
+    Окна (x0, y0, x1, y1) с перекрытием overlap, покрывающие изображение;
+    последние окна ряда и столбца прижимаются к краю изображения
+    """
+    step = max(1, tile_size - overlap)
+
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x0, y0, min(width, x0 + tile_size), min(height, y0 + tile_size))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def encode_tiles(source: TileSource, windows: List[tuple], quality: int = 90) -> List[tuple]:
+    """JPEG-кодирование окон для бэкенда детекции: [(байты, (ширина, высота)), ...]"""
+    tiles = []
+    for window in windows:
+        tile = Image.fromarray(source.read(window))
+        buffered = io.BytesIO()
+        tile.save(buffered, format="JPEG", quality=quality)
+        tiles.append((buffered.getvalue(), tile.size))
+    return tiles
+
+
+def merge_tile_detections(tile_detections: List[list], windows: List[tuple], image_size: tuple,
+                          iou_threshold: float = 0.5, edge_margin: int = 2, top_k: int = None) -> list:
+    """
+    Переводит детекции тайлов в координаты всего изображения и объединяет их.
+
+    Бокс, упирающийся во внутреннюю границу тайла, - обрезанный объект на шве;
+    при перекрытии тайлов не меньше размера объекта тот же объект целиком есть
+    в соседнем тайле, поэтому такие боксы отбрасываются, если в другом тайле
+    есть бокс того же класса, который их перекрывает. Оставшиеся дубли из зон
+    перекрытия убираются NMS по классам.
+    """
+    width, height = image_size
+    boxes, scores, classes, cut = [], [], [], []
+    for detections, (x0, y0, x1, y1) in zip(tile_detections, windows):
+        for detection in detections:
+            bx1, by1, bx2, by2 = detection["bbox"]
+            # Касание внутренних (не совпадающих с краем изображения) границ тайла
+            touches = (
+                (x0 > 0 and bx1 <= edge_margin) or (y0 > 0 and by1 <= edge_margin)
+                or (x1 < width and bx2 >= x1 - x0 - edge_margin)
+                or (y1 < height and by2 >= y1 - y0 - edge_margin)
+            )
+            boxes.append((bx1 + x0, by1 + y0, bx2 + x0, by2 + y0))
+            scores.append(detection["confidence"])
+            classes.append(detection["class"])
+            cut.append(touches)
+
+    if not boxes:
+        return []
+
+    boxes = np.array(boxes, dtype=np.float64)
+    scores = np.array(scores, dtype=np.float64)
+    class_names = sorted(set(classes))
+    class_ids = np.array([class_names.index(name) for name in classes], dtype=np.int64)
+    cut = np.array(cut, dtype=bool)
+
+    keep = np.ones(len(boxes), dtype=bool)
+    for i in np.flatnonzero(cut):
+        same = (class_ids == class_ids[i]) & ~cut
+        if not same.any():
+            continue
+        others = boxes[same]
+        # Доля обрезанного бокса, покрытая целым боксом того же класса
+        ix = np.clip(np.minimum(boxes[i, 2], others[:, 2]) - np.maximum(boxes[i, 0], others[:, 0]), 0, None)
+        iy = np.clip(np.minimum(boxes[i, 3], others[:, 3]) - np.maximum(boxes[i, 1], others[:, 1]), 0, None)
+        area = max((boxes[i, 2] - boxes[i, 0]) * (boxes[i, 3] - boxes[i, 1]), 1.0)
+        if ((ix * iy) / area).max() >= 0.5:
+            keep[i] = False
+
+    indices = np.flatnonzero(keep)
+    if iou_threshold < 1.0:
+        kept = class_aware_nms(boxes[indices], scores[indices], class_ids[indices], iou_threshold, top_k)
+    else:
+        kept = np.argsort(-scores[indices], kind="stable")[:top_k]
+    indices = indices[kept]
+
+    return [
+        {"class": class_names[class_id], "confidence": score, "bbox": [int(value) for value in bbox]}
+        for class_id, score, bbox in zip(class_ids[indices].tolist(), scores[indices].tolist(),
+                                         boxes[indices].tolist())
+    ]
+
+
+async def detect_tiled(source: TileSource, detector, tile_size: int, overlap: int,
+                       batch_size: int = 8, concurrency: int = 2, confidence_threshold: float = 0.1,
+                       iou_threshold: float = 0.5, top_k: int = None) -> Tuple[list, int]:
+    """
+    Потайловая детекция: окна кодируются группами по batch_size, каждая группа
+    уходит в бэкенд одним вызовом detect_batch; одновременно обрабатывается
+    не больше concurrency групп. Возвращает (детекции в координатах
+    изображения, число тайлов).
+
+    Кодирование идет в потоках, а не в пуле анализа: memmap-источник
+    нельзя передать в процесс-воркер без копирования всего изображения.
+    """
+    width, height = source.size
+    windows = tile_windows(width, height, tile_size, overlap)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def detect_group(group: List[tuple]) -> list:
+        async with semaphore:
+            tiles = await asyncio.to_thread(encode_tiles, source, group)
+            results = await detector.detect_batch(tiles, confidence_threshold)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    groups = [windows[i:i + batch_size] for i in range(0, len(windows), batch_size)]
+    tile_detections = []
+    for results in await asyncio.gather(*(detect_group(group) for group in groups)):
+        tile_detections.extend(results)
+
+    detections = merge_tile_detections(tile_detections, windows, (width, height), iou_threshold,
+                                       top_k=top_k)
+    return detections, len(windows)
+
+
+def render_preview(source: TileSource, detections: list, max_side: int) -> str:
+    """Уменьшенное изображение с разметкой (base64 JPEG) для ответа потайлового анализа"""
+    preview = source.preview(max_side)
+    width, height = source.size
+    scale_x, scale_y = preview.width / width, preview.height / height
+    scaled = [
+        dict(detection, bbox=[
+            detection["bbox"][0] * scale_x, detection["bbox"][1] * scale_y,
+            detection["bbox"][2] * scale_x, detection["bbox"][3] * scale_y,
+        ])
+        for detection in detections
+    ]
+    return image_to_base64(draw_detections_pil(preview, scaled))
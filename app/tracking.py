@@ -0,0 +1,114 @@
+
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+class Track:
+    """Объект, прослеженный по кадрам; best - снимок кадра с максимальной уверенностью детектора"""
+
+    def __init__(self, track_id: int, detection: dict, frame: int, timestamp: float, snapshot):
+        self.track_id = track_id
+        self.object_type = detection["class"]
+        self.bbox = detection["bbox"]
+        self.hits = 1
+        self.misses = 0
+        self.first_frame = self.last_frame = frame
+        self.first_time = self.last_time = timestamp
+        self.best_detection = detection
+        self.best_frame = frame
+        self.snapshot = snapshot
+
+    def update(self, detection: dict, frame: int, timestamp: float, snapshot: Optional[Callable]):
+        self.bbox = detection["bbox"]
+        self.hits += 1
+        self.misses = 0
+        self.last_frame = frame
+        self.last_time = timestamp
+        if detection["confidence"] > self.best_detection["confidence"]:
+            self.best_detection = detection
+            self.best_frame = frame
+            self.snapshot = snapshot(detection) if snapshot is not None else None
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """IoU всех пар боксов [x1, y1, x2, y2]: матрица (len(a), len(b))"""
+    ix = np.clip(np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+                 - np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0]), 0, None)
+    iy = np.clip(np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+                 - np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1]), 0, None)
+    intersection = ix * iy
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+class IoUTracker:
+    """
+    Легковесный трекер по пересечению боксов соседних отобранных кадров.
+
+    Детекции кадра жадно сопоставляются с активными треками того же класса
+    по убыванию IoU (не ниже iou_threshold); несопоставленные детекции
+    открывают новые треки. Трек закрывается, пропустив больше max_age кадров
+    подряд. В результат попадают треки, подтвержденные min_hits детекциями -
+    одиночные ложные срабатывания отсеиваются.
+
+    Для каждого трека хранится только снимок лучшего кадра (snapshot -
+    функция от детекции, вызывается при улучшении уверенности), а не кадры целиком.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_age: int = 2, min_hits: int = 2):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.active: List[Track] = []
+        self.finished: List[Track] = []
+        self._next_id = 1
+
+    def update(self, detections: list, frame: int, timestamp: float, snapshot: Optional[Callable] = None):
+        matched_tracks, matched_detections = set(), set()
+        if self.active and detections:
+            track_boxes = np.array([track.bbox for track in self.active], dtype=np.float64)
+            detection_boxes = np.array([detection["bbox"] for detection in detections], dtype=np.float64)
+            iou = iou_matrix(track_boxes, detection_boxes)
+            same_class = (np.array([track.object_type for track in self.active])[:, None]
+                          == np.array([detection["class"] for detection in detections])[None, :])
+            iou[~same_class] = 0.0
+
+            rows, cols = np.nonzero(iou >= self.iou_threshold)
+            for k in np.argsort(-iou[rows, cols], kind="stable").tolist():
+                t, d = int(rows[k]), int(cols[k])
+                if t in matched_tracks or d in matched_detections:
+                    continue
+                matched_tracks.add(t)
+                matched_detections.add(d)
+                self.active[t].update(detections[d], frame, timestamp, snapshot)
+
+        still_active = []
+        for t, track in enumerate(self.active):
+            if t not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_age:
+                    self._finish(track)
+                    continue
+            still_active.append(track)
+
+        for d, detection in enumerate(detections):
+            if d not in matched_detections:
+                still_active.append(Track(self._next_id, detection, frame, timestamp,
+                                          snapshot(detection) if snapshot is not None else None))
+                self._next_id += 1
+        self.active = still_active
+
+    def _finish(self, track: Track):
+        if track.hits >= self.min_hits:
+            self.finished.append(track)
+        # Снимки неподтвержденных треков сразу освобождаются
+
+    def close(self) -> List[Track]:
+        """Закрывает оставшиеся треки; подтвержденные треки в порядке появления"""
+        for track in self.active:
+            self._finish(track)
+        self.active = []
+        return sorted(self.finished, key=lambda track: track.track_id)
@@ -1,17 +1,151 @@
 
 import base64
+import hashlib
 import io
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 
-def base64_to_image(base64_string: str) -> Image.Image:
-    """Convert base64 string to PIL Image"""
+def decode_base64(base64_string: str) -> bytes:
+    """Convert base64 string (optionally a data URI) to raw encoded image bytes"""
     if base64_string.startswith('data:image'):
         base64_string = base64_string.split(',')[1]
     
-    image_data = base64.b64decode(base64_string)
+    return base64.b64decode(base64_string)
+
+def bytes_to_image(image_data: bytes) -> Image.Image:
+    """Open encoded image bytes as PIL Image (pixels are decoded lazily, once)"""
     return Image.open(io.BytesIO(image_data))
 
+def base64_to_image(base64_string: str) -> Image.Image:
+    """Convert base64 string to PIL Image"""
+    return bytes_to_image(decode_base64(base64_string))
+
+class ImageTooLarge(ValueError):
+    """Image exceeds the configured byte or pixel limit"""
+
+def configure_pil_limit(max_pixels: int):
+    """
+    Set PIL's decompression-bomb limit once per process (0 - no limit).
+    It is global, so it is never changed per request: every decode path
+    checks its own pixel limit explicitly, the PIL limit is only a backstop.
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels or None
+
+# EXIF Orientation -> transpose operation that makes the image upright
+_EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def exif_orientation(image: Image.Image) -> int:
+    """EXIF Orientation tag of an opened image (1 if absent)"""
+    try:
+        return image.getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+def apply_orientation(image: Image.Image, orientation: int) -> Image.Image:
+    """Rotate/flip image according to EXIF orientation"""
+    method = _EXIF_TRANSPOSE.get(orientation)
+    return image.transpose(method) if method is not None else image
+
+def rgb_pixels(image: Image.Image) -> np.ndarray:
+    """(H, W, 3) uint8 array of the image: one copy, no convert() if it is already RGB"""
+    return np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+
+def fit_size(size: tuple, max_side: int) -> tuple:
+    """Size scaled down so that its longer side is at most max_side (0 - no limit)"""
+    width, height = size
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    ratio = max_side / max(width, height)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+def open_bounded(image_bytes: bytes, max_bytes: int = 0, max_pixels: int = 0, max_side: int = 0) -> tuple:
+    """
+    Open image bytes with size limits and decode them straight to at most max_side
+    (JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale without materializing the full frame).
+    Returns (upright RGB/L image, upright original size, EXIF orientation, source format).
+    """
+    if max_bytes and len(image_bytes) > max_bytes:
+        raise ImageTooLarge(f"Image is too large: {len(image_bytes)} bytes > {max_bytes}")
+    
+    try:
+        image = bytes_to_image(image_bytes)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Image is too large: {width}x{height} pixels > {max_pixels}")
+    
+    orientation = exif_orientation(image)
+    source_format = image.format
+    target = fit_size((width, height), max_side)
+    mode = "L" if image.mode in ("L", "1") else "RGB"
+    if target != (width, height):
+        image.draft(mode, target)
+    if image.mode != mode:
+        image = image.convert(mode)
+    if image.size != target:
+        image = image.resize(target, Image.BILINEAR)
+    image.load()
+    
+    original_size = (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+    return apply_orientation(image, orientation), original_size, orientation, source_format
+
+class DecodedImage:
+    """
+    Image decoded at working resolution.
+    image - upright working image; original_size - upright size of the source;
+    encoded - bytes sent to the detector (the source itself when no resize/rotation was needed);
+    source - original encoded bytes.
+    """
+    
+    def __init__(self, image: Image.Image, original_size: tuple, encoded: bytes, source: bytes):
+        self.image = image
+        self.original_size = original_size
+        self.encoded = encoded
+        self.source = source
+        # Stage durations measured while decoding (seconds)
+        self.timings = {}
+        self.scale_x = original_size[0] / image.width
+        self.scale_y = original_size[1] / image.height
+    
+    @property
+    def size(self) -> tuple:
+        return self.image.size
+    
+    def to_original(self, detections: list) -> list:
+        """Map detection boxes from working to original image coordinates"""
+        if self.scale_x == 1 and self.scale_y == 1:
+            return detections
+        return [
+            dict(detection, bbox=[
+                round(detection["bbox"][0] * self.scale_x), round(detection["bbox"][1] * self.scale_y),
+                round(detection["bbox"][2] * self.scale_x), round(detection["bbox"][3] * self.scale_y),
+            ])
+            for detection in detections
+        ]
+
+def decode_image(image_bytes: bytes, max_bytes: int = 0, max_pixels: int = 0, max_side: int = 0,
+                 quality: int = 90) -> DecodedImage:
+    """Bounded decode of an uploaded image into a DecodedImage for detection and ROI analysis"""
+    image, original_size, orientation, source_format = open_bounded(image_bytes, max_bytes, max_pixels, max_side)
+    
+    if image.size == original_size and orientation == 1 and source_format in ("JPEG", "PNG"):
+        encoded = image_bytes
+    else:
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG", quality=quality)
+        encoded = buffered.getvalue()
+    
+    return DecodedImage(image, original_size, encoded, image_bytes)
+
 def image_to_base64(image: Image.Image) -> str:
     """Convert PIL Image to base64 string"""
     buffered = io.BytesIO()
@@ -60,3 +194,41 @@ def draw_detections(image: np.ndarray, detections: list) -> np.ndarray:
             draw.text((x1+5, y1-15), label, fill="white")
     
     return np.array(pil_image)
+
+def draw_detections_pil(pil_image: Image.Image, detections: list) -> Image.Image:
+    """Рисует bounding boxes на изображении с использованием PIL"""
+    # Создаем копию изображения чтобы не изменять оригинал
+    image_copy = pil_image.copy()
+    draw = ImageDraw.Draw(image_copy)
+    
+    for detection in detections:
+        x1, y1, x2, y2 = detection["bbox"]
+        class_name = detection["class"]
+        confidence = detection["confidence"]
+        
+        # Выбираем цвет в зависимости от класса
+        color = "green" if class_name == "tree" else "blue"
+        
+        # Рисуем bounding box
+        draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
+        
+        # Рисуем метку
+        label = f"{class_name} {confidence:.2f}"
+        # Рисуем фон для текста
+        text_bbox = draw.textbbox((x1, y1 - 20), label)
+        draw.rectangle(text_bbox, fill=color)
+        draw.text((x1, y1 - 20), label, fill="white")
+    
+    return image_copy
+
+def seeded_digest(seed: int, *chunks: bytes, digest_size: int = 32) -> bytes:
+    """
+    Stable BLAKE2 digest of the given chunks keyed by seed.
+    Unlike hash(), it does not depend on PYTHONHASHSEED, so it is the same in every process.
+    """
+    digest = hashlib.blake2b(key=str(seed).encode(), digest_size=digest_size)
+    for chunk in chunks:
+        # Length prefix keeps ("ab", "c") and ("a", "bc") apart
+        digest.update(len(chunk).to_bytes(8, "little"))
+        digest.update(chunk)
+    return digest.digest()
@@ -0,0 +1,208 @@
+
+import asyncio
+import io
+import shutil
+from collections import deque
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.tracking import IoUTracker, Track
+from app.utils import open_bounded, rgb_pixels
+
+
+class VideoDecodeError(ValueError):
+    pass
+
+
+# Демуксеры, которые ffmpeg может выбрать при определении формата загрузки.
+# Плейлисты и списки файлов (hls, concat и т.п.) сюда не входят: они ссылаются
+# на другие файлы и URL
+VIDEO_DEMUXERS = ("mov", "mp4", "matroska", "webm", "avi", "mpegts", "mpeg", "flv", "asf", "ogg", "h264", "hevc")
+
+
+def ffmpeg_available(ffmpeg_path: str) -> bool:
+    return shutil.which(ffmpeg_path) is not None
+
+
+async def video_frames(path: str, ffmpeg_path: str, fps: float, max_side: int = 0, max_frames: int = 0,
+                       demuxers: tuple = VIDEO_DEMUXERS) -> AsyncIterator[Tuple[float, np.ndarray]]:
+    """
+    Кадры видеофайла (время в секундах, массив (H, W, 3) uint8) по мере декодирования.
+
+    ffmpeg сам прореживает поток до fps кадров в секунду и уменьшает кадры до
+    max_side, отдавая их в pipe как PPM (размер кадра в заголовке каждого кадра,
+    поэтому ffprobe не нужен). Пока потребитель не забрал кадр, ffmpeg
+    блокируется на записи в pipe - в памяти не больше пары кадров.
+
+    Загрузка недоверенная: ffmpeg открывает только локальный файл и pipe
+    (-protocol_whitelist), а формат выбирает лишь среди demuxers
+    (-format_whitelist), поэтому плейлист не заставит его читать URL или
+    другие файлы.
+    """
+    filters = [f"fps={fps}"]
+    if max_side:
+        filters.append(
+            f"scale=w=min(iw\\,{max_side}):h=min(ih\\,{max_side}):force_original_aspect_ratio=decrease"
+        )
+    command = [
+        ffmpeg_path, "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-protocol_whitelist", "file,pipe", "-format_whitelist", ",".join(demuxers),
+        "-i", f"file:{path}", "-an", "-sn", "-vf", ",".join(filters),
+    ]
+    if max_frames:
+        command += ["-frames:v", str(max_frames)]
+    command += ["-f", "image2pipe", "-c:v", "ppm", "-"]
+
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    # stderr читается параллельно, чтобы ffmpeg не заблокировался на нем
+    errors = asyncio.ensure_future(process.stderr.read())
+    count = 0
+    try:
+        while True:
+            frame = await _read_ppm(process.stdout)
+            if frame is None:
+                break
+            yield count / fps, frame
+            count += 1
+        await process.wait()
+        if process.returncode != 0 and count == 0:
+            message = (await errors).decode(errors="replace").strip().splitlines()
+            raise VideoDecodeError(f"Unsupported video: {message[-1] if message else process.returncode}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        errors.cancel()
+
+
+async def _read_ppm(stream) -> Optional[np.ndarray]:
+    """Один кадр PPM (P6, 8 бит) из потока; None в конце потока"""
+    magic = await stream.readline()
+    if not magic:
+        return None
+    if magic.strip() != b"P6":
+        raise VideoDecodeError("Unexpected frame format from ffmpeg")
+    width, height = (int(value) for value in (await stream.readline()).split())
+    await stream.readline()  # максимальное значение (255)
+    try:
+        data = await stream.readexactly(width * height * 3)
+    except asyncio.IncompleteReadError:
+        return None
+    return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+
+
+def decode_frame(image_bytes: bytes, max_side: int, max_bytes: int = 0, max_pixels: int = 0) -> np.ndarray:
+    """Кадр последовательности изображений: ограниченное декодирование сразу в рабочее разрешение"""
+    image, _, _, _ = open_bounded(image_bytes, max_bytes, max_pixels, max_side)
+    return rgb_pixels(image)
+
+
+async def sequence_frames(files: list, frame_rate: float, max_side: int, max_bytes: int = 0,
+                          max_pixels: int = 0) -> AsyncIterator[Tuple[float, np.ndarray]]:
+    """Кадры последовательности загруженных изображений (в порядке загрузки) с частотой frame_rate"""
+    for index, file in enumerate(files):
+        image_bytes = await file.read()
+        pixels = await asyncio.to_thread(decode_frame, image_bytes, max_side, max_bytes, max_pixels)
+        yield index / frame_rate, pixels
+
+
+class SceneSampler:
+    """
+    Отбор кадров по изменению сцены: кадр пропускается, если средняя
+    абсолютная разница его уменьшенной серой копии с последним отобранным
+    кадром меньше threshold (доля от 255). threshold=0 - отбираются все кадры.
+    """
+
+    def __init__(self, threshold: float = 0.0, thumbnail_side: int = 64):
+        self.threshold = threshold
+        self.thumbnail_side = thumbnail_side
+        self._last = None
+
+    def accept(self, pixels: np.ndarray) -> bool:
+        if self.threshold <= 0:
+            return True
+        step = max(1, max(pixels.shape[:2]) // self.thumbnail_side)
+        thumbnail = pixels[::step, ::step].mean(axis=2)
+        if (self._last is None or thumbnail.shape != self._last.shape
+                or np.abs(thumbnail - self._last).mean() / 255.0 >= self.threshold):
+            self._last = thumbnail
+            return True
+        return False
+
+
+def encode_frame(pixels: np.ndarray, quality: int = 90) -> bytes:
+    """JPEG-кодирование кадра для бэкенда детекции"""
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def snapshot_roi(pixels: np.ndarray, bbox: list, max_side: int) -> Optional[np.ndarray]:
+    """
+    Копия ROI кадра для последующего анализа трека, уменьшенная (ближайший
+    сосед) до max_side - кадр целиком после этого не нужен
+    """
+    height, width = pixels.shape[:2]
+    x1, y1, x2, y2 = (int(value) for value in bbox)
+    x1, x2 = max(0, x1), min(width, x2)
+    y1, y2 = max(0, y1), min(height, y2)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    step = max(1, -(-max(x2 - x1, y2 - y1) // max_side))
+    return np.ascontiguousarray(pixels[y1:y2:step, x1:x2:step])
+
+
+async def track_frames(frames: AsyncIterator, detect: Callable, tracker: IoUTracker, sampler: SceneSampler,
+                       concurrency: int = 4, snapshot_size: int = 256) -> dict:
+    """
+    Прогоняет кадры через детектор и трекер. Детекция одновременно идет не
+    больше чем для concurrency кадров; следующий кадр декодируется только
+    когда освободилось место, поэтому буфер кадров ограничен. Трекер
+    получает детекции строго в порядке кадров.
+    """
+    stats = {"frames_read": 0, "frames_analyzed": 0, "detections": 0, "frame_size": None}
+    pending = deque()
+
+    async def track_next():
+        frame, timestamp, pixels, task = pending.popleft()
+        detections = await task
+        stats["detections"] += len(detections)
+        tracker.update(detections, frame, timestamp,
+                       lambda detection: snapshot_roi(pixels, detection["bbox"], snapshot_size))
+
+    try:
+        async for timestamp, pixels in frames:
+            frame = stats["frames_read"]
+            stats["frames_read"] += 1
+            if not sampler.accept(pixels):
+                continue
+            stats["frames_analyzed"] += 1
+            stats["frame_size"] = (pixels.shape[1], pixels.shape[0])
+            pending.append((frame, timestamp, pixels, asyncio.ensure_future(detect(pixels))))
+            if len(pending) >= concurrency:
+                await track_next()
+        while pending:
+            await track_next()
+    finally:
+        for *_, task in pending:
+            task.cancel()
+        await frames.aclose()
+    return stats
+
+
+def track_summary(track: Track) -> dict:
+    """Поля трека для ответа (дополняют результат анализа его лучшего кадра)"""
+    return {
+        "track_id": track.track_id,
+        "frames": track.hits,
+        "first_frame": track.first_frame,
+        "last_frame": track.last_frame,
+        "first_time": round(track.first_time, 3),
+        "last_time": round(track.last_time, 3),
+        "best_frame": track.best_frame,
+        "bbox": [int(value) for value in track.best_detection["bbox"]],
+    }
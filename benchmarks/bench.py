@@ -0,0 +1,416 @@
+"""
+Нагрузочный бенчмарк анализа изображений.
+
+Прогоняет изображения из Санитарка/ (и/или синтетические изображения
+заданных размеров) через /api/v1/analyze/raw на нескольких уровнях
+параллелизма и сохраняет результат в JSON: пропускная способность,
+p50/p95/p99, пиковый RSS и разбивка по этапам (из заголовка Server-Timing).
+
+Режим in-process (по умолчанию) поднимает приложение внутри процесса
+бенчмарка через ASGI-транспорт httpx; сеть не нужна:
+
+    python benchmarks/bench.py --concurrency 1,4,16 --requests 200
+    python benchmarks/bench.py --detector fake --fake-latency-ms 80
+    python benchmarks/bench.py --synthetic 640x480,1920x1080,6000x4000 --no-corpus
+
+--detector stub - встроенная заглушка, fake - локальный стенд
+tools/fake_inference_server.py (запускается автоматически, проверяет
+реальный HTTP-клиент детектора, ретраи и батчинг).
+
+Режим HTTP нагружает уже запущенный сервер; для разбивки по этапам
+сервер нужно запустить с SERVER_TIMING=1, для RSS - передать его pid:
+
+    SERVER_TIMING=1 ROBOFLOW_API_URL=http://localhost:9001 uvicorn app.main:app
+    python benchmarks/bench.py --url http://localhost:8000 --server-pid 12345
+
+Сравнение с предыдущим прогоном:
+
+    python benchmarks/bench.py --compare benchmarks/results/<прошлый>.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_DIR = os.path.join(ROOT, "Санитарка")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def load_corpus(path: str, limit: int = 0) -> list:
+    """Непустые изображения каталога в стабильном порядке: [(имя, байты), ...]"""
+    images = []
+    for name in sorted(os.listdir(path)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with open(os.path.join(path, name), "rb") as f:
+            data = f.read()
+        # В корпусе есть пустые файлы - они ничего не говорят о производительности
+        if data:
+            images.append((name, data))
+        if limit and len(images) >= limit:
+            break
+    return images
+
+
+def synthetic_image(width: int, height: int, seed: int) -> bytes:
+    """JPEG заданного размера с "деревьями"; одинаковый seed дает одинаковые байты"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), color=(135, 190, 230))
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(3, 8)):
+        x = rng.randint(0, max(1, width - 1))
+        y = rng.randint(0, max(1, height - 1))
+        radius = rng.randint(max(2, width // 40), max(3, width // 8))
+        draw.rectangle([x - radius // 6, y, x + radius // 6, y + radius * 2], fill=(110, 70, 40))
+        draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=(30, rng.randint(100, 180), 40))
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+
+def parse_sizes(value: str) -> list:
+    sizes = []
+    for item in filter(None, value.split(",")):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def parse_server_timing(header: str) -> dict:
+    """'decode;dur=1.2, detect;dur=30' -> {'decode': 1.2, 'detect': 30.0} (мс)"""
+    timings = {}
+    for part in filter(None, (item.strip() for item in header.split(","))):
+        name, _, params = part.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                timings[name.strip()] = float(value)
+    return timings
+
+
+def read_rss_mb(pid: int) -> float:
+    """Текущий RSS процесса в МБ (Linux /proc); 0, если недоступно"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return 0.0
+
+
+class RssSampler:
+    """Фоновый опрос RSS процесса; пик считается отдельно для каждого уровня"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, read_rss_mb(self.pid))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = read_rss_mb(self.pid)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> float:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return round(max(self.peak, read_rss_mb(self.pid)), 1)
+
+
+def summarize_latencies(latencies: list) -> dict:
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(p50), 2),
+        "p95": round(float(p95), 2),
+        "p99": round(float(p99), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+def summarize_stages(stage_samples: dict) -> dict:
+    stages = {}
+    for name, values in stage_samples.items():
+        values = np.array(values)
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        stages[name] = {
+            "mean": round(float(values.mean()), 2),
+            "p50": round(float(p50), 2),
+            "p95": round(float(p95), 2),
+            "p99": round(float(p99), 2),
+        }
+    return stages
+
+
+async def run_level(client, path: str, images: list, concurrency: int, total: int, sampler: RssSampler) -> dict:
+    """total запросов, не более concurrency одновременно; изображения идут по кругу"""
+    latencies = []
+    status_codes = {}
+    stage_samples = {}
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            _, data = images[i % len(images)]
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, content=data, headers={"content-type": "image/jpeg"})
+            except Exception:
+                errors += 1
+                status_codes["exception"] = status_codes.get("exception", 0) + 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            status_codes[str(response.status_code)] = status_codes.get(str(response.status_code), 0) + 1
+            if response.status_code != 200:
+                errors += 1
+                continue
+            for name, duration in parse_server_timing(response.headers.get("server-timing", "")).items():
+                stage_samples.setdefault(name, []).append(duration)
+
+    sampler.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_time = time.perf_counter() - started
+    peak_rss = await sampler.stop()
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "status_codes": status_codes,
+        "wall_time_s": round(wall_time, 3),
+        "throughput_rps": round(total / wall_time, 2) if wall_time else 0.0,
+        "latency_ms": summarize_latencies(latencies),
+        "peak_rss_mb": peak_rss,
+        "stages_ms": summarize_stages(stage_samples),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_detector(latency_ms: float) -> tuple:
+    """Запускает tools/fake_inference_server.py на свободном порту"""
+    port = free_port()
+    env = dict(os.environ, FAKE_LATENCY_MS=str(latency_ms), FAKE_ERROR_RATE="0")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fake_inference_server:app", "--app-dir", os.path.join(ROOT, "tools"),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Fake inference server did not start")
+
+
+def configure_in_process(args, detector_url: str = None):
+    """
+    Настройки приложения читаются при импорте, поэтому окружение
+    выставляется до импорта app.main
+    """
+    os.environ["SERVER_TIMING"] = "1"
+    # Ответы заглушек зависят только от изображения и seed - прогоны сравнимы
+    os.environ["DETERMINISTIC"] = "1"
+    os.environ["ANALYSIS_SEED"] = str(args.seed)
+    # Вся нагрузка идет от одного клиента - лимиты допуска исказили бы замер
+    os.environ["ADMISSION_ENABLED"] = "0"
+    if not args.cache:
+        os.environ["DETECTION_CACHE_SIZE"] = "0"
+    if args.detector == "stub":
+        os.environ["DETECTOR_BACKEND"] = "stub"
+    else:
+        os.environ["DETECTOR_BACKEND"] = "roboflow"
+        os.environ["ROBOFLOW_API_URL"] = detector_url
+        os.environ.setdefault("ROBOFLOW_API_KEY", "benchmark")
+    sys.path.insert(0, ROOT)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_benchmark(args, images: list) -> list:
+    import httpx
+
+    path = f"/api/v1/analyze/raw?render={args.render}"
+    levels = []
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout,
+                                   limits=httpx.Limits(max_connections=max(args.concurrency)))
+        sampler = RssSampler(args.server_pid or os.getpid())
+        app = None
+    else:
+        from app.main import app
+        # ASGI-транспорт не вызывает lifespan - запускаем его сами
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                   timeout=args.timeout)
+        sampler = RssSampler(os.getpid())
+
+    try:
+        if args.warmup:
+            await run_level(client, path, images, 1, args.warmup, RssSampler(sampler.pid))
+        for concurrency in args.concurrency:
+            level = await run_level(client, path, images, concurrency, args.requests, sampler)
+            levels.append(level)
+            latency = level["latency_ms"]
+            print(
+                f"concurrency={concurrency:<4} rps={level['throughput_rps']:<8} "
+                f"p50={latency.get('p50')}ms p95={latency.get('p95')}ms p99={latency.get('p99')}ms "
+                f"errors={level['errors']} rss={level['peak_rss_mb']}MB"
+            )
+    finally:
+        await client.aclose()
+        if app is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    return levels
+
+
+def compare(current: dict, previous_path: str):
+    """Печатает изменение ключевых показателей относительно прошлого прогона"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    previous_levels = {level["concurrency"]: level for level in previous["levels"]}
+    print(f"\nCompared with {previous_path} (revision {previous['meta'].get('revision')}):")
+    for level in current["levels"]:
+        old = previous_levels.get(level["concurrency"])
+        if old is None:
+            continue
+        parts = []
+        for key in ("p50", "p95", "p99"):
+            before, after = old["latency_ms"].get(key), level["latency_ms"].get(key)
+            if before and after:
+                parts.append(f"{key} {(after - before) / before * 100:+.1f}%")
+        before, after = old["throughput_rps"], level["throughput_rps"]
+        if before:
+            parts.append(f"rps {(after - before) / before * 100:+.1f}%")
+        print(f"  concurrency={level['concurrency']}: " + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the tree analysis API")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--server-pid", type=int, help="Server pid for RSS sampling in --url mode")
+    parser.add_argument("--detector", choices=["stub", "fake"], default="stub",
+                        help="Stand-in detector for the in-process mode")
+    parser.add_argument("--fake-latency-ms", type=float, default=50.0)
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5, help="Warm-up requests (not recorded)")
+    parser.add_argument("--render", choices=["inline", "none", "deferred"], default="inline")
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--no-corpus", action="store_true", help="Use only synthetic images")
+    parser.add_argument("--limit", type=int, default=0, help="Max corpus images (0 - all)")
+    parser.add_argument("--synthetic", default="", help="Synthetic image sizes, e.g. 640x480,4000x3000")
+    parser.add_argument("--cache", action="store_true", help="Keep the detection cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/<time>_<rev>.json)")
+    parser.add_argument("--compare", help="Previous result JSON to compare with")
+    args = parser.parse_args()
+    args.concurrency = [int(value) for value in args.concurrency.split(",") if value]
+
+    # Порядок и синтетические изображения зависят от seed
+    images = [] if args.no_corpus else load_corpus(args.corpus, args.limit)
+    for i, (width, height) in enumerate(parse_sizes(args.synthetic)):
+        images.append((f"synthetic_{width}x{height}", synthetic_image(width, height, args.seed + i)))
+    if not images:
+        parser.error("No images to benchmark")
+    random.Random(args.seed).shuffle(images)
+    print(f"Benchmarking with {len(images)} images")
+
+    fake_process = None
+    if not args.url:
+        detector_url = None
+        if args.detector == "fake":
+            fake_process, detector_url = start_fake_detector(args.fake_latency_ms)
+        configure_in_process(args, detector_url)
+
+    try:
+        levels = asyncio.run(run_benchmark(args, images))
+    finally:
+        if fake_process is not None:
+            fake_process.terminate()
+            fake_process.wait()
+
+    revision = git_revision()
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": revision,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": "http" if args.url else "in-process",
+            "detector": None if args.url else args.detector,
+            "fake_latency_ms": args.fake_latency_ms if args.detector == "fake" and not args.url else None,
+            "render": args.render,
+            "images": len(images),
+            "image_bytes_total": sum(len(data) for _, data in images),
+            "synthetic": args.synthetic,
+            "cache": args.cache,
+            "seed": args.seed,
+            "requests_per_level": args.requests,
+        },
+        "levels": levels,
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}_{revision}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Production-запуск: несколько процессов uvicorn под управлением gunicorn.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+preload_app: приложение импортируется в мастер-процессе до fork, поэтому
+код, модели-заглушки и веса детектора (DetectorBackend.preload) загружаются
+один раз и разделяются воркерами (copy-on-write). Сетевые клиенты, сессии
+ONNX Runtime, пулы и очереди создаются в lifespan каждого воркера - после fork.
+
+Состояние в памяти процесса у каждого воркера свое: задачи /jobs при
+JOB_STORE=memory, ссылки render=deferred, кэш детекций без DETECTION_CACHE_PATH,
+лимиты допуска при ADMISSION_STORE=memory, а также /metrics - счетчики и
+гистограммы отдает тот воркер, который принял запрос. Поэтому по умолчанию
+воркер один; при WEB_CONCURRENCY > 1 запуск с JOB_STORE=memory отклоняется.
+"""
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Прогрев в lifespan должен уложиться в timeout
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """Проверка настроек, которые не работают с несколькими воркерами"""
+    if server.cfg.workers <= 1:
+        return
+    from app.config import settings
+    if settings.job_store == "memory":
+        raise RuntimeError(
+            "JOB_STORE=memory keeps jobs inside one worker, so /jobs would return 404 "
+            "on other workers: set JOB_STORE=sqlite or WEB_CONCURRENCY=1"
+        )
+    server.log.warning(
+        "%d workers: render=deferred links, /metrics%s%s are per worker",
+        server.cfg.workers,
+        "" if settings.detection_cache_path else ", the detection cache",
+        ", admission limits" if settings.admission_store == "memory" else "",
+    )
@@ -0,0 +1,49 @@
+import pytest
+from PIL import Image
+
+from app.tiling import open_tile_source
+from app.utils import ImageTooLarge, configure_pil_limit
+
+
+def _sparse_ppm(path, width, height):
+    """PPM-заголовок и разреженный файл нужного размера без записи пикселей"""
+    header = f"P6\n{width} {height}\n255\n".encode()
+    with open(path, "wb") as f:
+        f.write(header)
+        f.truncate(len(header) + width * height * 3)
+
+
+@pytest.fixture
+def pil_limit():
+    saved = Image.MAX_IMAGE_PIXELS
+    configure_pil_limit(1_000_000_000)
+    yield
+    Image.MAX_IMAGE_PIXELS = saved
+
+
+def test_open_tile_source_beyond_pil_bomb_limit(tmp_path, pil_limit):
+    path = tmp_path / "ortho.ppm"
+    _sparse_ppm(path, 20000, 20000)
+
+    source = open_tile_source(str(path), max_pixels=1_000_000_000)
+
+    assert source.kind == "memmap"
+    assert source.size == (20000, 20000)
+    assert source.read((0, 0, 4, 4)).shape == (4, 4, 3)
+
+
+def test_open_tile_source_over_limit(tmp_path, pil_limit):
+    path = tmp_path / "ortho.ppm"
+    _sparse_ppm(path, 20000, 20000)
+
+    with pytest.raises(ImageTooLarge):
+        open_tile_source(str(path), max_pixels=100_000_000)
+
+
+def test_open_tile_source_over_pil_limit(tmp_path):
+    # Без настройки лимита при старте срабатывает защита PIL - тоже 413, а не 500
+    path = tmp_path / "ortho.ppm"
+    _sparse_ppm(path, 20000, 20000)
+
+    with pytest.raises(ImageTooLarge):
+        open_tile_source(str(path), max_pixels=1_000_000_000)
@@ -0,0 +1,72 @@
+"""
+Локальный стенд, имитирующий Roboflow inference API (формат hosted API v0).
+
+Позволяет проверять и нагружать сервис без сети и без расхода квоты:
+
+    uvicorn fake_inference_server:app --app-dir tools --port 9001
+    ROBOFLOW_API_URL=http://localhost:9001 uvicorn app.main:app
+
+Ответ детерминирован: одно и то же изображение дает одни и те же боксы.
+Координаты боксов отдаются в единицах, которые ожидает
+TreeDetector._process_predictions (проценты от размера изображения).
+
+Переменные окружения:
+    FAKE_LATENCY_MS   - искусственная задержка ответа
+    FAKE_ERROR_RATE   - доля запросов, на которые отвечаем 503 (0..1)
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+app = FastAPI(title="Fake inference server")
+
+LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "50"))
+ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+CLASSES = ["tree", "shrub"]
+
+
+@app.post("/{project}/{version}")
+async def infer(project: str, version: str, request: Request, api_key: str = "", confidence: float = 0.4):
+    body = await request.body()
+    if LATENCY_MS:
+        await asyncio.sleep(LATENCY_MS / 1000.0)
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        return JSONResponse(status_code=503, content={"message": "Simulated failure"})
+    if not api_key:
+        return JSONResponse(status_code=401, content={"message": "API key is required"})
+
+    try:
+        image_bytes = base64.b64decode(body)
+        width, height = Image.open(io.BytesIO(image_bytes)).size
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"message": f"Invalid image: {e}"})
+
+    rng = random.Random(hashlib.blake2b(image_bytes, digest_size=8).digest())
+    predictions = []
+    for i in range(rng.randint(1, 5)):
+        score = round(rng.uniform(0.05, 0.95), 3)
+        if score < confidence:
+            continue
+        w, h = rng.uniform(5, 30), rng.uniform(10, 50)
+        predictions.append({
+            "x": rng.uniform(w / 2, 100 - w / 2),
+            "y": rng.uniform(h / 2, 100 - h / 2),
+            "width": w,
+            "height": h,
+            "confidence": score,
+            "class": rng.choice(CLASSES),
+            "class_id": i,
+        })
+
+    return {
+        "time": LATENCY_MS / 1000.0,
+        "image": {"width": width, "height": height},
+        "predictions": predictions,
+    }